@@ -0,0 +1,184 @@
+"""
+Reusable Model Input Buffers
+Preallocated float32 (rows, height, width, 3) batch buffers that decoded
+images are written into directly. Without the pool every request allocates
+its own pixel array, batch copy, prediction copy and softmax temporaries;
+with it the only per-request array is the decoder's uint8 output.
+
+Buffers are kept per (rows, height, width) shape, rows rounded up to a power
+of two so variable job batch sizes share a handful of shapes. If a shape's
+free list is empty a buffer is allocated on the spot (counted in stats) and
+kept for reuse afterwards, up to max_free_per_shape.
+
+Benchmark (the server's preprocess_image vs preprocess_image_into on a pooled
+buffer, real model, same PREPROCESS_DIAGNOSTICS setting for both; tracemalloc):
+    python buffer_pool.py --requests 200 [--diagnostics]
+"""
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+CHANNELS = 3
+
+
+def softmax_in_place(predictions: np.ndarray) -> np.ndarray:
+    """
+    Row-wise softmax, written back into `predictions`, for rows that look like
+    logits (don't sum to ~1). Rows that are already probabilities are untouched.
+    """
+    for row in predictions:
+        if abs(float(row.sum()) - 1.0) > 0.01:
+            row -= row.max()
+            np.exp(row, out=row)
+            row /= row.sum()
+    return predictions
+
+
+def _round_rows(rows: int) -> int:
+    return 1 << max(0, rows - 1).bit_length()
+
+
+class BatchBufferPool:
+    """Thread-safe free lists of float32 model-input batches."""
+
+    def __init__(self, max_free_per_shape: int = 4, max_rows: int = 64, dtype=np.float32):
+        self.max_free_per_shape = max_free_per_shape
+        self.max_rows = max_rows
+        self.dtype = np.dtype(dtype)
+        self._free: Dict[Tuple[int, int, int], List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "reused": 0, "allocated": 0, "oversized": 0, "in_use": 0}
+
+    def _shape(self, rows: int, input_size: Tuple[int, int]) -> Tuple[int, int, int]:
+        width, height = input_size  # PIL order, like TARGET_SIZE
+        return (min(_round_rows(rows), self.max_rows), height, width)
+
+    def _allocate(self, shape: Tuple[int, int, int]) -> np.ndarray:
+        return np.empty(shape + (CHANNELS,), dtype=self.dtype)
+
+    def preallocate(self, input_size: Tuple[int, int], rows: int = 1, count: int = 1) -> None:
+        """Fill the free list for a shape ahead of the first requests"""
+        shape = self._shape(rows, input_size)
+        with self._lock:
+            free = self._free.setdefault(shape, [])
+            while len(free) < min(count, self.max_free_per_shape):
+                free.append(self._allocate(shape))
+
+    @contextmanager
+    def acquire(self, rows: int, input_size: Tuple[int, int]) -> Iterator[np.ndarray]:
+        """
+        Yield a (rows, height, width, 3) view of a pooled buffer. Contents are
+        undefined; the caller overwrites every row it passes to the model. The
+        view must not be used after the with-block.
+        """
+        if rows > self.max_rows:
+            # Bigger than anything the pool keeps - plain one-off allocation
+            with self._lock:
+                self._stats["acquired"] += 1
+                self._stats["oversized"] += 1
+            yield self._allocate((rows,) + self._shape(1, input_size)[1:])
+            return
+
+        shape = self._shape(rows, input_size)
+        with self._lock:
+            free = self._free.setdefault(shape, [])
+            buffer = free.pop() if free else None
+            self._stats["acquired"] += 1
+            self._stats["reused" if buffer is not None else "allocated"] += 1
+            self._stats["in_use"] += 1
+        if buffer is None:
+            buffer = self._allocate(shape)
+        try:
+            yield buffer[:rows]
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+                free = self._free[shape]
+                if len(free) < self.max_free_per_shape:
+                    free.append(buffer)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retained = sum(buf.nbytes for free in self._free.values() for buf in free)
+            acquired = self._stats["acquired"]
+            return {
+                **self._stats,
+                "reuse_rate": round(self._stats["reused"] / acquired, 4) if acquired else None,
+                "shapes": {f"{r}x{h}x{w}": len(free) for (r, h, w), free in self._free.items()},
+                "retained_mb": round(retained / (1024 * 1024), 2),
+            }
+
+
+# ============================================================================
+# BENCHMARK: unpooled vs pooled request path, using the server's own functions
+# ============================================================================
+if __name__ == "__main__":
+    import argparse
+    import io
+    import logging
+    import os
+    import time
+    import tracemalloc
+
+    os.environ.setdefault("RESULT_CACHE_BACKEND", "none")  # no shared cache file for an offline run
+
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description="Per-request memory with and without the buffer pool")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--size", type=int, nargs=2, default=(1024, 768), help="Source image width height")
+    parser.add_argument("--diagnostics", action="store_true",
+                        help="Run both paths with PREPROCESS_DIAGNOSTICS on (default: off, as in production)")
+    args = parser.parse_args()
+
+    import inference_server as server  # loads the real model
+
+    # Same diagnostics setting for both paths, so only pooling differs
+    server.PREPROCESS_DIAGNOSTICS = args.diagnostics
+    logging.getLogger(server.__name__).setLevel(logging.WARNING)
+
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (args.size[1], args.size[0], 3), dtype=np.uint8))
+    encoded = io.BytesIO()
+    image.save(encoded, format="JPEG", quality=90)
+    image_bytes = encoded.getvalue()
+
+    def unpooled(data: bytes) -> int:
+        """Fresh input array per request, copied prediction row, out-of-place softmax"""
+        batch = server.preprocess_image(data)
+        predictions = np.array(server.model.predict_on_batch(batch), dtype=np.float32)
+        row = predictions[0].copy()
+        exp = np.exp(row - np.max(row))
+        return int(np.argmax(exp / np.sum(exp)))
+
+    def pooled(data: bytes) -> int:
+        """The /predict path: decode into a pooled buffer, softmax in place on the model output"""
+        with server.buffer_pool.acquire(1, server.TARGET_SIZE) as batch:
+            server.preprocess_image_into(data, batch[0])
+            predictions = server.to_probabilities(server.model.predict_on_batch(batch))
+        return int(np.argmax(predictions[0]))
+
+    def measure(name: str, fn) -> float:
+        fn(image_bytes)  # warm-up (also fills the pool)
+        tracemalloc.start()
+        peaks = []
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            fn(image_bytes)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        elapsed = time.perf_counter() - start
+        tracemalloc.stop()
+        peak = sorted(peaks)[len(peaks) // 2]
+        print(f"{name:<9} median peak traced memory/request: {peak / 1024:8.1f} KB   "
+              f"time/request: {elapsed / args.requests * 1000:6.2f} ms")
+        return peak
+
+    print(f"{args.requests} requests, {args.size[0]}x{args.size[1]} JPEG -> {server.TARGET_SIZE} float32, "
+          f"diagnostics {'on' if args.diagnostics else 'off'} for both paths")
+    old = measure("unpooled", unpooled)
+    new = measure("pooled", pooled)
+    print(f"Peak memory per request: {old / max(new, 1):.2f}x; pool stats: {server.buffer_pool.stats()}")
@@ -0,0 +1,188 @@
+"""
+Leaf Pre-Filter Calibration
+Runs a local image set through both the leaf pre-filter and the real model and
+uses the model's own Background_without_leaves answer as the reference:
+
+- false rejection: the filter rejects an image the model classifies as a leaf
+  class (these users would lose a real diagnosis)
+- catch rate: share of the model's Background_without_leaves images the filter
+  rejects (inference the server no longer spends)
+
+Also suggests per-score thresholds that keep the false-rejection rate at or
+below --target-frr on this image set. The filter's enabled flag is ignored
+here - every image is scored against the configured thresholds.
+
+Thresholds come from the same LEAF_FILTER_* environment variables the server
+reads, so a candidate setting can be checked before deploying it:
+
+    LEAF_FILTER_MIN_SHARPNESS=20 python calibrate_leaf_filter.py ./leaf_photos --report calibration.json
+"""
+import os
+
+os.environ.setdefault("RESULT_CACHE_BACKEND", "none")  # no shared cache file for an offline run
+
+import argparse
+import json
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from fastapi import HTTPException
+
+import inference_server as server
+from leaf_filter import REJECT_CLASS, leaf_scores
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# score -> (LeafFilter attribute, environment variable, rejects when score is "below"/"above",
+#           only applies below quality_max_plant_ratio)
+SCORE_RULES = {
+    "dark_ratio": ("max_dark_ratio", "LEAF_FILTER_MAX_DARK_RATIO", "above", False),
+    "bright_ratio": ("max_bright_ratio", "LEAF_FILTER_MAX_BRIGHT_RATIO", "above", False),
+    "contrast": ("min_contrast", "LEAF_FILTER_MIN_CONTRAST", "below", True),
+    "sharpness": ("min_sharpness", "LEAF_FILTER_MIN_SHARPNESS", "below", True),
+    "plant_ratio": ("min_plant_ratio", "LEAF_FILTER_MIN_PLANT_RATIO", "below", False),
+}
+
+
+def evaluate(paths: List[Path], batch_size: int) -> List[Dict[str, Any]]:
+    """Filter decision, scores and model answer for every readable image"""
+    rows = []
+    for start in range(0, len(paths), batch_size):
+        arrays, batch_rows = [], []
+        for path in paths[start:start + batch_size]:
+            try:
+                processed = server.preprocess_image(path.read_bytes())
+            except HTTPException:
+                rows.append({"path": str(path), "unreadable": True})
+                continue
+            scores = leaf_scores(processed[0])
+            arrays.append(processed)
+            batch_rows.append({
+                "path": str(path),
+                "filter_reason": server.leaf_filter.rejection_reason(scores),
+                "scores": scores,
+            })
+        if not arrays:
+            continue
+        probabilities = server.to_probabilities(server.model.predict_on_batch(np.concatenate(arrays)))
+        for row, probs in zip(batch_rows, probabilities):
+            prediction = server.build_prediction(probs)
+            row["model_class"] = prediction["class_name"]
+            row["model_confidence"] = round(prediction["confidence"], 4)
+        rows.extend(batch_rows)
+        print(f"   {min(start + batch_size, len(paths))}/{len(paths)} images")
+    return rows
+
+
+def suggest_thresholds(leaf_rows: List[Dict], background_rows: List[Dict], target_frr: float) -> Dict[str, Any]:
+    """Per score: the loosest-safe threshold on this set and what it alone would catch"""
+    suggestions = {}
+    gate = server.leaf_filter.quality_max_plant_ratio
+    for score, (attribute, env_var, direction, gated) in SCORE_RULES.items():
+        leaf_in_scope, background_in_scope = leaf_rows, background_rows
+        if gated:  # these rules only ever see images with little plant colour
+            leaf_in_scope = [row for row in leaf_rows if row["scores"]["plant_ratio"] < gate]
+            background_in_scope = [row for row in background_rows if row["scores"]["plant_ratio"] < gate]
+        values = np.array([row["scores"][score] for row in leaf_in_scope])
+        background = np.array([row["scores"][score] for row in background_in_scope])
+        if direction == "below":
+            threshold = float(np.quantile(values, target_frr)) if len(values) else None
+            caught = int((background < threshold).sum()) if threshold is not None else 0
+        else:
+            threshold = float(np.quantile(values, 1.0 - target_frr)) if len(values) else None
+            caught = int((background > threshold).sum()) if threshold is not None else 0
+        suggestions[score] = {
+            "env": env_var,
+            "current": getattr(server.leaf_filter, attribute),
+            "suggested": round(threshold, 4) if threshold is not None else None,
+            "background_caught_alone": caught,
+        }
+    return suggestions
+
+
+def summarize(rows: List[Dict[str, Any]], target_frr: float) -> Dict[str, Any]:
+    scored = [row for row in rows if not row.get("unreadable")]
+    leaf_rows = [row for row in scored if row["model_class"] != REJECT_CLASS]
+    background_rows = [row for row in scored if row["model_class"] == REJECT_CLASS]
+    false_rejections = [row for row in leaf_rows if row["filter_reason"]]
+    caught = [row for row in background_rows if row["filter_reason"]]
+    rejected = [row for row in scored if row["filter_reason"]]
+
+    by_reason: Dict[str, Counter] = {}
+    for row in rejected:
+        counts = by_reason.setdefault(row["filter_reason"], Counter())
+        counts["rejected"] += 1
+        counts["false_rejections"] += row["model_class"] != REJECT_CLASS
+
+    return {
+        "images": len(rows),
+        "unreadable": len(rows) - len(scored),
+        "model_leaf_images": len(leaf_rows),
+        "model_background_images": len(background_rows),
+        "filter_rejected": len(rejected),
+        "false_rejections": len(false_rejections),
+        "false_rejection_rate": round(len(false_rejections) / len(leaf_rows), 4) if leaf_rows else None,
+        "background_catch_rate": round(len(caught) / len(background_rows), 4) if background_rows else None,
+        "model_calls_saved": round(len(rejected) / len(scored), 4) if scored else None,
+        "by_reason": {reason: dict(counts) for reason, counts in by_reason.items()},
+        "thresholds": server.leaf_filter.thresholds(),
+        "suggested_thresholds": suggest_thresholds(leaf_rows, background_rows, target_frr),
+        "false_rejection_examples": [
+            {key: row[key] for key in ("path", "filter_reason", "model_class", "model_confidence", "scores")}
+            for row in false_rejections[:50]
+        ],
+    }
+
+
+def print_summary(summary: Dict[str, Any], target_frr: float) -> None:
+    print("=" * 70)
+    print("LEAF PRE-FILTER CALIBRATION")
+    print("=" * 70)
+    print(f"Images: {summary['images']} ({summary['unreadable']} unreadable)")
+    print(f"Model says leaf: {summary['model_leaf_images']}   "
+          f"Model says {REJECT_CLASS}: {summary['model_background_images']}")
+    print(f"Current thresholds: {summary['thresholds']}")
+    print(f"False-rejection rate: {summary['false_rejection_rate']} "
+          f"({summary['false_rejections']} leaf images rejected)")
+    print(f"Background catch rate: {summary['background_catch_rate']}   "
+          f"Model calls saved: {summary['model_calls_saved']}")
+    for reason, counts in summary["by_reason"].items():
+        print(f"   {reason:<13} rejected={counts['rejected']:<5} false={counts.get('false_rejections', 0)}")
+    for example in summary["false_rejection_examples"][:10]:
+        print(f"   ✗ {example['path']} ({example['filter_reason']}) model: "
+              f"{example['model_class']} {example['model_confidence']:.2f}")
+    print("-" * 70)
+    print(f"Per-score thresholds keeping false rejections <= {target_frr:.1%} on this set:")
+    for score, suggestion in summary["suggested_thresholds"].items():
+        print(f"   {suggestion['env']}={suggestion['suggested']}   "
+              f"(current {suggestion['current']}, alone catches "
+              f"{suggestion['background_caught_alone']} background images)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the leaf pre-filter against the model's background class")
+    parser.add_argument("images", type=Path, help="Directory of images (searched recursively)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, help="Only use the first N images")
+    parser.add_argument("--target-frr", type=float, default=0.005, help="False-rejection budget for suggestions")
+    parser.add_argument("--report", type=Path, help="Write the summary (and per-image rows) as JSON")
+    args = parser.parse_args()
+
+    paths = sorted(p for p in args.images.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if args.limit:
+        paths = paths[:args.limit]
+    if not paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    start = time.time()
+    rows = evaluate(paths, args.batch_size)
+    summary = summarize(rows, args.target_frr)
+    print_summary(summary, args.target_frr)
+    print(f"Done in {time.time() - start:.1f}s")
+
+    if args.report:
+        args.report.write_text(json.dumps({**summary, "images_detail": rows}, indent=2))
+        print(f"Report written to {args.report}")
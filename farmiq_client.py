@@ -0,0 +1,519 @@
+"""
+FarmIQ Crop Disease Detection - Python Client
+Talks to inference_server.py with pooled keep-alive connections, bounded
+concurrency (sync and asyncio), retries that honour Retry-After, and an
+optional client-side resize that matches the server's preprocessing.
+
+Usage:
+    from farmiq_client import FarmIQClient
+
+    with FarmIQClient("http://localhost:8000") as client:
+        result = client.predict("leaf.jpg")
+        results = client.predict_many(["a.jpg", "b.jpg"], concurrency=8)
+        print(client.report())
+
+Command line:
+    python farmiq_client.py leaf.jpg photos/ --concurrency 8
+"""
+import asyncio
+import email.utils
+import io
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, PngImagePlugin
+
+logger = logging.getLogger(__name__)
+
+API_URL = "http://localhost:8000"
+
+# Must match TARGET_SIZE and the resampling filter in inference_server.preprocess_image
+TARGET_SIZE = (160, 160)
+RESAMPLING = Image.Resampling.LANCZOS
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+ImageInput = Union[str, Path, bytes, Image.Image]
+
+
+class PredictionError(Exception):
+    """Raised when a prediction fails after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def prepare_image(
+    image: ImageInput,
+    resize: bool = True,
+    image_format: str = "PNG",
+    jpeg_quality: int = 90,
+) -> Tuple[bytes, int, str]:
+    """
+    Load an image and (optionally) shrink it to the model input size before upload.
+
+    Uses the same steps as the server (convert to RGB, LANCZOS resize to
+    160x160). With PNG the server receives exactly the pixels it would have
+    produced itself - its own resize is then a no-op. JPEG is smaller still but lossy.
+
+    Returns (upload_bytes, original_size_in_bytes, content_type).
+    """
+    if isinstance(image, Image.Image):
+        img, original_bytes = image, None
+    else:
+        original_bytes = image if isinstance(image, bytes) else Path(image).read_bytes()
+        img = Image.open(io.BytesIO(original_bytes))
+        if not resize:
+            content_type = Image.MIME.get(img.format, "image/jpeg")
+            return original_bytes, len(original_bytes), content_type
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if resize:
+        img = img.resize(TARGET_SIZE, RESAMPLING)
+
+    buffer = io.BytesIO()
+    if image_format.upper() in ("JPEG", "JPG"):
+        img.save(buffer, format="JPEG", quality=jpeg_quality)
+        content_type = "image/jpeg"
+    else:
+        img.save(buffer, format="PNG")
+        content_type = "image/png"
+    upload = buffer.getvalue()
+    original_size = len(original_bytes) if original_bytes is not None else len(upload)
+    return upload, original_size, content_type
+
+
+def prepare_frame(image: ImageInput) -> np.ndarray:
+    """Decode and resize an image to a (160, 160, 3) uint8 frame for /predict/raw"""
+    if isinstance(image, Image.Image):
+        img = image
+    else:
+        data = image if isinstance(image, bytes) else Path(image).read_bytes()
+        img = Image.open(io.BytesIO(data))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img.resize(TARGET_SIZE, RESAMPLING), dtype=np.uint8)
+
+
+def unique_png(frame: np.ndarray, nonce: str) -> bytes:
+    """
+    Lossless PNG of `frame` with `nonce` in a text chunk: the server decodes
+    the same pixels, but the bytes (and so the result-cache key) are new.
+    """
+    info = PngImagePlugin.PngInfo()
+    info.add_text("farmiq-nonce", nonce)
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format="PNG", pnginfo=info)
+    return buffer.getvalue()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After as seconds; accepts delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def expand_image_paths(paths: Iterable[Union[str, Path]]) -> List[Path]:
+    """Expand directories into the image files they contain"""
+    expanded = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            expanded.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def _percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class FarmIQClient:
+    """
+    Client for the crop disease inference server.
+
+    One client shares a keep-alive connection pool across all threads and
+    coroutines that use it; create it once and reuse it.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        pool_size: int = 16,
+        timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        max_backoff: float = 30.0,
+        resize: bool = True,
+        image_format: str = "PNG",
+        jpeg_quality: int = 90,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.resize = resize
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+
+        self.session = requests.Session()
+        # Retries are handled in _request so Retry-After and backoff are under our control
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    # ------------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------------
+    def close(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+    def __enter__(self) -> "FarmIQClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # ------------------------------------------------------------------------
+    # HTTP with retries
+    # ------------------------------------------------------------------------
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        url = f"{self.base_url}{path}"
+        kwargs.setdefault("timeout", self.timeout)
+        files = kwargs.get("files")
+
+        for attempt in range(self.max_retries + 1):
+            if files:
+                # Rewind file-like payloads so a retry re-sends the full body
+                for value in files.values():
+                    if hasattr(value[1], "seek"):
+                        value[1].seek(0)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise PredictionError(f"Request failed after {attempt + 1} attempts: {e}")
+                delay = self._backoff(attempt)
+                logger.warning(f"⚠️ {method} {path} failed ({e}); retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = min(retry_after, self.max_backoff) if retry_after is not None else self._backoff(attempt)
+                logger.warning(f"⚠️ {method} {path} returned {response.status_code}; retrying in {delay:.2f}s")
+                response.close()
+
+            with self._stats_lock:
+                self._stats["retries"] += 1
+            time.sleep(delay)
+
+        raise PredictionError(f"{method} {path} exhausted retries")  # pragma: no cover
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    # ------------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------------
+    def health(self) -> Dict[str, Any]:
+        response = self._request("GET", "/health")
+        response.raise_for_status()
+        return response.json()
+
+    def predict(
+        self,
+        image: ImageInput,
+        user_id: Optional[str] = None,
+        plot_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Predict the disease for one image; raises PredictionError on failure"""
+        start = time.perf_counter()
+        try:
+            payload, original_size, content_type = prepare_image(
+                image, resize=self.resize, image_format=self.image_format, jpeg_quality=self.jpeg_quality
+            )
+
+            data = {k: v for k, v in (("user_id", user_id), ("plot_id", plot_id)) if v is not None}
+            files = {"file": ("image", io.BytesIO(payload), content_type)}
+            response = self._request("POST", "/predict", files=files, data=data)
+            if response.status_code != 200:
+                raise PredictionError(
+                    f"Prediction failed ({response.status_code}): {response.text[:200]}",
+                    status_code=response.status_code,
+                )
+            result = response.json()
+        except Exception:
+            self._record(time.perf_counter() - start, ok=False)
+            raise
+        self._record(time.perf_counter() - start, ok=True, uploaded=len(payload), original=original_size)
+        return result
+
+    def predict_raw(self, frames: np.ndarray) -> Dict[str, Any]:
+        """
+        Send already-decoded uint8 frames, (160, 160, 3) or (N, 160, 160, 3),
+        to /predict/raw - the server skips image decoding entirely.
+        """
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        if frames.shape[-3:] != (TARGET_SIZE[1], TARGET_SIZE[0], 3):
+            raise ValueError(f"frames must end in shape (160, 160, 3), got {frames.shape}")
+        start = time.perf_counter()
+        try:
+            response = self._request(
+                "POST", "/predict/raw",
+                data=frames.tobytes(),
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            if response.status_code != 200:
+                raise PredictionError(
+                    f"Raw prediction failed ({response.status_code}): {response.text[:200]}",
+                    status_code=response.status_code,
+                )
+            result = response.json()
+        except Exception:
+            self._record(time.perf_counter() - start, ok=False)
+            raise
+        self._record(time.perf_counter() - start, ok=True, uploaded=frames.nbytes, original=frames.nbytes)
+        return result
+
+    def predict_many(
+        self,
+        images: Iterable[ImageInput],
+        concurrency: int = 8,
+        **kwargs,
+    ) -> List[Union[Dict[str, Any], PredictionError]]:
+        """
+        Predict many images with at most `concurrency` uploads in flight.
+        Results keep input order; failed items hold the PredictionError.
+        """
+        images = list(images)
+        concurrency = max(1, min(concurrency, self.pool_size))
+        self._mark_wall_start()
+
+        def run(image):
+            try:
+                return self.predict(image, **kwargs)
+            except PredictionError as e:
+                return e
+            except Exception as e:
+                return PredictionError(str(e))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(run, images))
+        self._mark_wall_end()
+        return results
+
+    async def predict_async(self, image: ImageInput, **kwargs) -> Dict[str, Any]:
+        """asyncio wrapper around predict() that shares the client's connection pool"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="farmiq-client")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: self.predict(image, **kwargs))
+
+    async def predict_many_async(
+        self,
+        images: Iterable[ImageInput],
+        concurrency: int = 8,
+        **kwargs,
+    ) -> List[Union[Dict[str, Any], PredictionError]]:
+        """asyncio version of predict_many(); bounded by a semaphore"""
+        semaphore = asyncio.Semaphore(max(1, min(concurrency, self.pool_size)))
+        self._mark_wall_start()
+
+        async def run(image):
+            async with semaphore:
+                try:
+                    return await self.predict_async(image, **kwargs)
+                except PredictionError as e:
+                    return e
+                except Exception as e:
+                    return PredictionError(str(e))
+
+        results = await asyncio.gather(*(run(image) for image in images))
+        self._mark_wall_end()
+        return list(results)
+
+    # ------------------------------------------------------------------------
+    # Throughput report
+    # ------------------------------------------------------------------------
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self._stats = {
+                "succeeded": 0,
+                "failed": 0,
+                "retries": 0,
+                "bytes_original": 0,
+                "bytes_uploaded": 0,
+                "latencies": [],
+                "wall_start": None,
+                "wall_end": None,
+            }
+
+    def _record(self, latency: float, ok: bool, uploaded: int = 0, original: int = 0) -> None:
+        with self._stats_lock:
+            self._stats["succeeded" if ok else "failed"] += 1
+            self._stats["latencies"].append(latency)
+            self._stats["bytes_uploaded"] += uploaded
+            self._stats["bytes_original"] += original
+
+    def _mark_wall_start(self) -> None:
+        with self._stats_lock:
+            if self._stats["wall_start"] is None:
+                self._stats["wall_start"] = time.perf_counter()
+
+    def _mark_wall_end(self) -> None:
+        with self._stats_lock:
+            self._stats["wall_end"] = time.perf_counter()
+
+    def report(self) -> Dict[str, Any]:
+        """Throughput, latency percentiles and upload savings since the last reset"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = sorted(stats["latencies"])
+        total = stats["succeeded"] + stats["failed"]
+        wall = None
+        if stats["wall_start"] is not None and stats["wall_end"] is not None:
+            wall = stats["wall_end"] - stats["wall_start"]
+        to_ms = lambda v: round(v * 1000, 2) if v is not None else None
+        return {
+            "requests": total,
+            "succeeded": stats["succeeded"],
+            "failed": stats["failed"],
+            "retries": stats["retries"],
+            "wall_time_s": round(wall, 3) if wall else None,
+            "images_per_second": round(total / wall, 2) if wall else None,
+            "latency_ms": {
+                "p50": to_ms(_percentile(latencies, 50)),
+                "p95": to_ms(_percentile(latencies, 95)),
+                "p99": to_ms(_percentile(latencies, 99)),
+                "max": to_ms(latencies[-1] if latencies else None),
+            },
+            "bytes_original": stats["bytes_original"],
+            "bytes_uploaded": stats["bytes_uploaded"],
+            "upload_reduction": (
+                round(stats["bytes_original"] / stats["bytes_uploaded"], 1)
+                if stats["bytes_uploaded"] else None
+            ),
+        }
+
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Send images to the FarmIQ inference server")
+    parser.add_argument("images", nargs="+", help="Image files or directories")
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-resize", action="store_true", help="Upload original images unchanged")
+    parser.add_argument("--format", default="PNG", choices=["PNG", "JPEG"], help="Re-encode format after resize")
+    parser.add_argument("--jpeg-quality", type=int, default=90)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Use the asyncio API")
+    parser.add_argument("--compare-raw", action="store_true",
+                        help="Compare latency of /predict (encoded image) against /predict/raw")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    paths = expand_image_paths(args.images)
+    if not paths:
+        parser.error("no images found")
+
+    if args.compare_raw:
+        # Same pixels through both paths, sequentially, so the numbers are comparable.
+        # Each encoded upload carries a fresh nonce so the result cache can't answer it;
+        # any image still answered from the cache is left out of both columns.
+        run_id = uuid.uuid4().hex[:12]
+        with FarmIQClient(args.url, pool_size=1, resize=False) as client:
+            timings = {"encoded": [], "raw": []}
+            server_preprocess = {"encoded": [], "raw": []}
+            cache_hits = 0
+            for index, path in enumerate(paths):
+                frame = prepare_frame(path)
+                sample = {}
+                for mode in ("encoded", "raw"):
+                    start = time.perf_counter()
+                    if mode == "encoded":
+                        result = client.predict(unique_png(frame, f"{run_id}-{index}"))
+                    else:
+                        result = client.predict_raw(frame)
+                    sample[mode] = (time.perf_counter() - start, result["metadata"])
+                if any(metadata.get("cache_hit") for _, metadata in sample.values()):
+                    cache_hits += 1
+                    continue
+                for mode, (latency, metadata) in sample.items():
+                    timings[mode].append(latency)
+                    server_preprocess[mode].append(metadata["preprocessing_time_ms"])
+
+        print("=" * 60)
+        print(f"ENCODED vs RAW LATENCY ({len(timings['raw'])} images)")
+        print("=" * 60)
+        if cache_hits:
+            print(f"WARNING: {cache_hits} image(s) answered from the result cache were excluded")
+        if not timings["raw"]:
+            raise SystemExit("No uncached samples to compare")
+        for mode in ("encoded", "raw"):
+            values = sorted(timings[mode])
+            print(f"{mode:>8}: p50={_percentile(values, 50) * 1000:.2f}ms  "
+                  f"p95={_percentile(values, 95) * 1000:.2f}ms  "
+                  f"server preprocessing avg={sum(server_preprocess[mode]) / len(values):.3f}ms")
+        raise SystemExit(0)
+    print(f"Sending {len(paths)} images to {args.url} (concurrency={args.concurrency})")
+
+    with FarmIQClient(
+        args.url,
+        pool_size=max(args.concurrency, 1),
+        resize=not args.no_resize,
+        image_format=args.format,
+        jpeg_quality=args.jpeg_quality,
+    ) as client:
+        if args.use_async:
+            results = asyncio.run(client.predict_many_async(paths, concurrency=args.concurrency))
+        else:
+            results = client.predict_many(paths, concurrency=args.concurrency)
+
+        for path, result in zip(paths, results):
+            if isinstance(result, PredictionError):
+                print(f"❌ {path}: {result}")
+            else:
+                print(f"✅ {path}: {result['class_name']} ({result['confidence']*100:.2f}%)")
+
+        print()
+        print("=" * 60)
+        print("THROUGHPUT REPORT")
+        print("=" * 60)
+        print(json.dumps(client.report(), indent=2))
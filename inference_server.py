@@ -4,19 +4,38 @@ REAL Keras Model Integration - NO MOCK DATA
 """
 import os
 import sys
+import asyncio
 import io
 import time
 import logging
+import threading
+import hmac
+from urllib.parse import urlparse
 import numpy as np
+import hashlib
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
 import tensorflow as tf
 
+from prediction_store import PredictionStore
+from tiled_inference import load_image_for_tiling, run_tiled_inference
+from qos import AdaptiveQoSController, ServiceTier
+from model_manager import LoadedModel, ModelManager, ModelNotFoundError, ModelSpec
+from job_queue import CallbackURLError, Job, JobQueue
+from profiler import ProfilerBusyError, ProfilerCooldownError, ProfilerService
+from result_cache import cache_key, create_cache_backend
+from buffer_pool import BatchBufferPool, softmax_in_place
+from leaf_filter import (
+    DEFAULT_MAX_BRIGHT_RATIO, DEFAULT_MAX_DARK_RATIO, DEFAULT_MIN_CONTRAST, DEFAULT_MIN_PLANT_RATIO,
+    DEFAULT_MIN_SHARPNESS, DEFAULT_QUALITY_MAX_PLANT_RATIO, REJECT_CLASS, LeafFilter, LeafFilterResult,
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -49,6 +68,11 @@ if not MODEL_PATH.exists():
 
 logger.info(f"Model File Size: {MODEL_PATH.stat().st_size / (1024*1024):.2f} MB")
 
+# Content hash of the model file - identifies which weights produced a prediction
+with open(MODEL_PATH, "rb") as model_file:
+    MODEL_VERSION = f"{MODEL_PATH.stem}@{hashlib.sha256(model_file.read()).hexdigest()[:12]}"
+logger.info(f"Model Version: {MODEL_VERSION}")
+
 # Load the Keras model
 logger.info("")
 logger.info("Loading Keras Model...")
@@ -90,6 +114,79 @@ except Exception as e:
 logger.info("-" * 70)
 logger.info("")
 
+# ============================================================================
+# QUANTIZED MODEL VARIANT (optional, used by the cheapest QoS tier)
+# ============================================================================
+QUANTIZED_MODEL_PATH = Path(os.getenv(
+    "QUANTIZED_MODEL_PATH", str(BASE_DIR / "plant_disease_recog_model_pwp_int8.tflite")
+))
+
+class QuantizedModel:
+    """
+    TFLite interpreter behind the same predict()/predict_on_batch() calls as
+    the Keras model. The interpreter is not thread-safe, so calls are serialized.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=str(path))
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._lock = threading.Lock()
+        self._batch_size = None
+
+    def predict_on_batch(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch)
+        input_dtype = self.input_detail["dtype"]
+        if input_dtype in (np.int8, np.uint8):
+            scale, zero_point = self.input_detail["quantization"]
+            batch = np.clip(np.round(batch / scale + zero_point), np.iinfo(input_dtype).min,
+                            np.iinfo(input_dtype).max).astype(input_dtype)
+        else:
+            batch = batch.astype(input_dtype, copy=False)
+
+        with self._lock:
+            if self._batch_size != batch.shape[0]:
+                self.interpreter.resize_tensor_input(self.input_detail["index"], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input_detail["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail["index"])
+
+        if self.output_detail["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = self.output_detail["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        return self.predict_on_batch(batch)
+
+quantized_model = None
+QUANTIZED_MODEL_VERSION = None
+if QUANTIZED_MODEL_PATH.exists():
+    try:
+        quantized_model = QuantizedModel(QUANTIZED_MODEL_PATH)
+        with open(QUANTIZED_MODEL_PATH, "rb") as model_file:
+            QUANTIZED_MODEL_VERSION = (
+                f"{QUANTIZED_MODEL_PATH.stem}@{hashlib.sha256(model_file.read()).hexdigest()[:12]}"
+            )
+        logger.info(f"✅ Quantized model variant loaded: {QUANTIZED_MODEL_PATH.name}")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not load quantized model {QUANTIZED_MODEL_PATH}: {e}")
+else:
+    logger.info(f"No quantized model variant at {QUANTIZED_MODEL_PATH} - QoS tiers will use the full model")
+
+def model_for_tier(tier: ServiceTier):
+    """The model a QoS tier should run: the quantized variant if requested and available"""
+    if tier.use_quantized and quantized_model is not None:
+        return quantized_model
+    return model
+
+def model_version_of(active_model) -> str:
+    return QUANTIZED_MODEL_VERSION if active_model is quantized_model else MODEL_VERSION
+
 # ============================================================================
 # CLASS NAMES DEFINITION
 # ============================================================================
@@ -157,58 +254,74 @@ TARGET_SIZE = (160, 160)
 # The model was trained with: tf.keras.applications.efficientnet.preprocess_input
 preprocess_input = tf.keras.applications.efficientnet.preprocess_input
 
-def preprocess_image(image_bytes: bytes) -> np.ndarray:
+# Array statistics (min/max/mean/std/unique/hash) on every request are for
+# debugging only - they allocate several full-size temporaries per image
+PREPROCESS_DIAGNOSTICS = os.getenv("PREPROCESS_DIAGNOSTICS", "false").lower() == "true"
+
+# Reusable float32 input batches (see buffer_pool.py)
+buffer_pool = BatchBufferPool(
+    max_free_per_shape=int(os.getenv("BUFFER_POOL_SIZE", "8")),
+    max_rows=int(os.getenv("BUFFER_POOL_MAX_ROWS", "64")),
+)
+buffer_pool.preallocate(TARGET_SIZE, rows=1, count=int(os.getenv("BUFFER_POOL_PREALLOCATE", "4")))
+
+def preprocess_image_into(
+    image_bytes: bytes,
+    out: np.ndarray,
+    resample: Image.Resampling = Image.Resampling.LANCZOS,
+    draft_decode: bool = False,
+) -> np.ndarray:
     """
-    Preprocess image for model input
+    Preprocess image for model input, writing into `out` - one (height, width, 3)
+    float32 row of a pooled batch buffer. Target size is taken from `out`.
     Uses EfficientNet preprocessing (same as training) - NOT simple [0,1] normalization!
+    `resample` / `draft_decode` are lowered by the QoS controller under overload.
     """
+    target_size = (out.shape[1], out.shape[0])
     try:
         # Open image
         img = Image.open(io.BytesIO(image_bytes))
         logger.info(f"   Original image: {img.size}, mode: {img.mode}")
         
+        # Cheap tiers: let the JPEG decoder downscale by up to 8x while decoding
+        if draft_decode and img.format == "JPEG":
+            img.draft("RGB", (target_size[0] * 2, target_size[1] * 2))
+            logger.info(f"   Draft decode to: {img.size}")
+        
         # Convert to RGB if needed
         if img.mode != 'RGB':
             img = img.convert('RGB')
             logger.info(f"   Converted to RGB")
         
         # Resize to model input size
-        img = img.resize(TARGET_SIZE, Image.Resampling.LANCZOS)
-        logger.info(f"   Resized to: {TARGET_SIZE}")
-        
-        # Convert to numpy array (uint8, 0-255 range)
-        img_array = np.array(img, dtype=np.uint8)
-        logger.info(f"   Array shape: {img_array.shape}, dtype: {img_array.dtype}")
-        logger.info(f"   Value range (before preprocessing): [{img_array.min()}, {img_array.max()}]")
-        
-        # CRITICAL: Apply EfficientNet preprocessing (same as training)
-        # This converts to float32 and applies ImageNet normalization [-1, 1] range
-        img_array = preprocess_input(img_array)
-        logger.info(f"   Value range (after EfficientNet preprocessing): [{img_array.min():.3f}, {img_array.max():.3f}]")
-        logger.info(f"   Array dtype (after preprocessing): {img_array.dtype}")
-        
-        # Log image statistics to verify it's different for each request
-        logger.info(f"   Image statistics:")
-        logger.info(f"      Mean: {np.mean(img_array):.6f}")
-        logger.info(f"      Std: {np.std(img_array):.6f}")
-        logger.info(f"      Unique values: {len(np.unique(img_array))}")
-        
-        # Log a hash of the image to verify different images
-        import hashlib
-        img_hash = hashlib.md5(img_array.tobytes()).hexdigest()[:8]
-        logger.info(f"   Image array hash (first 8 chars): {img_hash}")
-        
-        # Add batch dimension: (160, 160, 3) -> (1, 160, 160, 3)
-        img_array = np.expand_dims(img_array, axis=0)
-        logger.info(f"   Final shape with batch: {img_array.shape}")
-        
-        # Verify the input is not all zeros or all same values
-        if np.all(img_array == 0):
+        img = img.resize(target_size, resample)
+        logger.info(f"   Resized to: {target_size} ({resample.name})")
+        
+        # Decoder output (uint8, 0-255) cast straight into the float32 buffer row
+        out[...] = np.asarray(img)
+        
+        # CRITICAL: Apply EfficientNet preprocessing (same as training), in place.
+        # For EfficientNet this is a pass-through (the model rescales internally).
+        normalized = preprocess_input(out)
+        if normalized is not out:
+            out[...] = normalized
+        
+        if PREPROCESS_DIAGNOSTICS:
+            # Log image statistics to verify it's different for each request
+            logger.info(f"   Value range (after EfficientNet preprocessing): [{out.min():.3f}, {out.max():.3f}]")
+            logger.info(f"   Image statistics:")
+            logger.info(f"      Mean: {np.mean(out):.6f}")
+            logger.info(f"      Std: {np.std(out):.6f}")
+            logger.info(f"      Unique values: {len(np.unique(out))}")
+            logger.info(f"   Image array hash (first 8 chars): {hashlib.md5(out.tobytes()).hexdigest()[:8]}")
+            if len(np.unique(out)) < 10:
+                logger.warning(f"   ⚠️ WARNING: Input has very few unique values: {len(np.unique(out))}")
+        
+        # Verify the input is not all zeros
+        if not out.any():
             logger.warning("   ⚠️ WARNING: Input image is all zeros!")
-        elif len(np.unique(img_array)) < 10:
-            logger.warning(f"   ⚠️ WARNING: Input has very few unique values: {len(np.unique(img_array))}")
         
-        return img_array
+        return out
         
     except Exception as e:
         logger.error(f"❌ Image preprocessing error: {e}")
@@ -216,6 +329,366 @@ def preprocess_image(image_bytes: bytes) -> np.ndarray:
         traceback.print_exc()
         raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
 
+def preprocess_image(
+    image_bytes: bytes,
+    resample: Image.Resampling = Image.Resampling.LANCZOS,
+    draft_decode: bool = False,
+    target_size: tuple = TARGET_SIZE,
+) -> np.ndarray:
+    """Standalone (1, height, width, 3) float32 input, for callers outside the buffer pool"""
+    batch = np.empty((1, target_size[1], target_size[0], 3), dtype=np.float32)
+    preprocess_image_into(image_bytes, batch[0], resample=resample, draft_decode=draft_decode)
+    return batch
+
+def to_probabilities(predictions: np.ndarray) -> np.ndarray:
+    """
+    Row-wise softmax for batched model outputs that look like logits;
+    rows that already sum to ~1 are returned unchanged. Works in place on
+    float32 outputs - pass only arrays the caller owns (fresh model outputs).
+    """
+    return softmax_in_place(np.asarray(predictions, dtype=np.float32))
+
+def build_prediction(
+    pred_array: np.ndarray,
+    class_names: Optional[List[str]] = None,
+    top_k: int = 3,
+) -> Dict[str, Any]:
+    """class_name / confidence / top_3 for one row of class probabilities"""
+    class_names = class_names if class_names is not None else CLASS_NAMES
+    valid_preds = pred_array[:len(class_names)]
+    if not np.isfinite(valid_preds).all():
+        raise HTTPException(status_code=500, detail="Model prediction failed: NaN/Inf values")
+    top_indices = np.argsort(valid_preds)[-top_k:][::-1]
+    top_idx = int(top_indices[0])
+    return {
+        "class_name": class_names[top_idx],
+        "confidence": float(valid_preds[top_idx]),
+        "top_3": [
+            {"class": class_names[i], "confidence": float(valid_preds[i])}
+            for i in top_indices
+        ],
+    }
+
+# ============================================================================
+# RAW TENSOR INGESTION (pre-resized uint8 frames, no image decode)
+# ============================================================================
+FRAME_SHAPE = (TARGET_SIZE[1], TARGET_SIZE[0], 3)
+FRAME_BYTES = FRAME_SHAPE[0] * FRAME_SHAPE[1] * FRAME_SHAPE[2]
+RAW_MAX_BATCH = int(os.getenv("RAW_MAX_BATCH", "64"))
+NPY_MAGIC = b"\x93NUMPY"
+NPY_HEADER_ALLOWANCE = 4096  # .npy headers are padded to 64 bytes; 4KB is far beyond any valid one
+RAW_MAX_BODY_BYTES = RAW_MAX_BATCH * FRAME_BYTES + NPY_HEADER_ALLOWANCE
+
+async def read_raw_body(request: Request) -> bytes:
+    """
+    Request body, refused with 413 as soon as it is known to exceed
+    RAW_MAX_BODY_BYTES - from Content-Length before anything is read, or
+    while streaming when the header is absent or wrong.
+    """
+    declared = request.headers.get("content-length")
+    if declared is not None:
+        if not declared.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid Content-Length")
+        if int(declared) > RAW_MAX_BODY_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Body of {declared} bytes exceeds {RAW_MAX_BODY_BYTES} ({RAW_MAX_BATCH} frames)",
+            )
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > RAW_MAX_BODY_BYTES:
+            raise HTTPException(
+                status_code=413, detail=f"Body exceeds {RAW_MAX_BODY_BYTES} bytes ({RAW_MAX_BATCH} frames)"
+            )
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def parse_raw_frames(body: bytes) -> np.ndarray:
+    """
+    Zero-copy view of a request body as a (N, 160, 160, 3) uint8 batch.
+
+    Accepts either raw interleaved RGB bytes (N * 160*160*3) or a `.npy`
+    payload of shape (160, 160, 3) or (N, 160, 160, 3) and dtype uint8.
+    The returned array is a read-only view over `body`.
+    """
+    if body.startswith(NPY_MAGIC):
+        stream = io.BytesIO(body)
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+        else:
+            raise ValueError(f"Unsupported .npy version: {version}")
+        if dtype != np.uint8:
+            raise ValueError(f"dtype must be uint8, got {dtype}")
+        if fortran_order:
+            raise ValueError("Fortran-ordered arrays are not supported; send a C-contiguous array")
+        if tuple(shape) == FRAME_SHAPE:
+            shape = (1,) + FRAME_SHAPE
+        if len(shape) != 4 or tuple(shape[1:]) != FRAME_SHAPE:
+            raise ValueError(f"shape must be {FRAME_SHAPE} or (N, {', '.join(map(str, FRAME_SHAPE))}), got {tuple(shape)}")
+        offset = stream.tell()
+        expected = shape[0] * FRAME_BYTES
+        if len(body) - offset != expected:
+            raise ValueError(f"Payload has {len(body) - offset} data bytes, header declares {expected}")
+        frames = np.frombuffer(body, dtype=np.uint8, count=expected, offset=offset)
+    else:
+        if len(body) == 0 or len(body) % FRAME_BYTES != 0:
+            raise ValueError(
+                f"Raw payload must be a multiple of {FRAME_BYTES} bytes "
+                f"(uint8 {FRAME_SHAPE[0]}x{FRAME_SHAPE[1]}x3), got {len(body)}"
+            )
+        frames = np.frombuffer(body, dtype=np.uint8)
+
+    frames = frames.reshape((-1,) + FRAME_SHAPE)
+    if frames.shape[0] == 0:
+        raise ValueError("Payload contains no frames")
+    if frames.shape[0] > RAW_MAX_BATCH:
+        raise ValueError(f"Batch of {frames.shape[0]} frames exceeds limit of {RAW_MAX_BATCH}")
+    return frames
+
+# ============================================================================
+# PREDICTION HISTORY STORE
+# ============================================================================
+PREDICTION_DB_PATH = Path(os.getenv("PREDICTION_DB_PATH", str(BASE_DIR / "predictions.db")))
+
+prediction_store = PredictionStore(
+    PREDICTION_DB_PATH,
+    batch_size=int(os.getenv("PREDICTION_DB_BATCH_SIZE", "256")),
+    flush_interval=float(os.getenv("PREDICTION_DB_FLUSH_INTERVAL", "0.5")),
+    max_queue_size=int(os.getenv("PREDICTION_DB_MAX_QUEUE", "10000")),
+)
+logger.info(f"Prediction history database: {PREDICTION_DB_PATH}")
+
+# ============================================================================
+# MULTI-MODEL SERVING
+# ============================================================================
+MODEL_REGISTRY_PATH = Path(os.getenv("MODEL_REGISTRY_PATH", str(BASE_DIR / "models.json")))
+DEFAULT_MODEL_NAME = "general"
+
+model_manager = ModelManager(
+    loader=lambda path: tf.keras.models.load_model(str(path), compile=False),
+    memory_budget_bytes=int(float(os.getenv("MODEL_RAM_BUDGET_MB", "2048")) * 1024 * 1024),
+    default_input_size=TARGET_SIZE,
+)
+
+# The general 39-class model is already in memory - register it pinned so it is never evicted
+_general_spec = ModelSpec(
+    name=DEFAULT_MODEL_NAME,
+    path=MODEL_PATH,
+    class_names=CLASS_NAMES,
+    routes=["default"],
+    description="General 39-class plant disease model",
+    pinned=True,
+)
+model_manager.register(_general_spec, preloaded=LoadedModel(
+    spec=_general_spec,
+    model=model,
+    class_names=CLASS_NAMES,
+    input_size=TARGET_SIZE,
+    version=MODEL_VERSION,
+    memory_bytes=int(model.count_params()) * 4,
+    load_time=0.0,
+))
+
+if MODEL_REGISTRY_PATH.exists():
+    try:
+        registered = model_manager.load_registry(MODEL_REGISTRY_PATH)
+        logger.info(f"✅ Registered {registered} additional model(s) from {MODEL_REGISTRY_PATH.name}")
+    except Exception as e:
+        logger.error(f"❌ Failed to read model registry {MODEL_REGISTRY_PATH}: {e}")
+else:
+    logger.info(f"No model registry at {MODEL_REGISTRY_PATH} - serving the general model only")
+
+# ============================================================================
+# SHARED RESULT CACHE (shared by all local workers)
+# ============================================================================
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "mmap").lower()
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "8192"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+def _result_cache_options() -> Dict[str, Any]:
+    options = {"max_entries": RESULT_CACHE_MAX_ENTRIES, "ttl_seconds": RESULT_CACHE_TTL_SECONDS}
+    if RESULT_CACHE_BACKEND == "mmap":
+        options["path"] = Path(os.getenv("RESULT_CACHE_PATH", str(BASE_DIR / "prediction_cache.mmap")))
+    elif RESULT_CACHE_BACKEND in ("redis", "resp"):
+        url = urlparse(os.getenv("RESULT_CACHE_REDIS_URL", "redis://127.0.0.1:6379/0"))
+        options.update(
+            host=url.hostname or "127.0.0.1",
+            port=url.port or 6379,
+            password=url.password,
+            db=int(url.path.lstrip("/") or 0),
+        )
+    return options
+
+try:
+    result_cache = create_cache_backend(RESULT_CACHE_BACKEND, **_result_cache_options())
+    logger.info(f"Result cache backend: {RESULT_CACHE_BACKEND}")
+except Exception as e:
+    logger.error(f"❌ Result cache disabled - could not initialize '{RESULT_CACHE_BACKEND}' backend: {e}")
+    result_cache = None
+
+def cached_prediction_response(
+    cached: Dict[str, Any],
+    request_id: str,
+    start_time: float,
+    image_hash: str,
+    tier: ServiceTier,
+    user_id: Optional[str],
+    plot_id: Optional[str],
+) -> JSONResponse:
+    """Response for a result-cache hit; still recorded in the prediction history"""
+    total_time = time.time() - start_time
+    prediction_store.record(
+        image_hash=image_hash,
+        class_name=cached["class_name"],
+        confidence=cached["confidence"],
+        top_k=cached["top_3"],
+        model_version=cached["model_version"],
+        latency_ms=round(total_time * 1000, 2),
+        user_id=user_id,
+        plot_id=plot_id,
+        request_id=request_id,
+    )
+    logger.info(f"✅ Cache hit ({result_cache.name}) for {image_hash[:8]}: {cached['class_name']}")
+    response = {
+        "class_name": cached["class_name"],
+        "confidence": cached["confidence"],
+        "top_3": cached["top_3"],
+        "metadata": {
+            "request_id": request_id,
+            "timestamp": time.time(),
+            "processing_time_ms": round(total_time * 1000, 2),
+            "model_name": cached.get("model_name", DEFAULT_MODEL_NAME),
+            "model_version": cached["model_version"],
+            "qos_tier": tier.name,
+            "cache_hit": True,
+            "cache_backend": result_cache.name,
+            "is_real_prediction": True,
+            "prediction_source": "result_cache",
+        },
+    }
+    json_response = JSONResponse(content=response)
+    json_response.headers["Cache-Control"] = "no-store"
+    json_response.headers["X-Prediction-Source"] = "result-cache"
+    json_response.headers["X-Request-ID"] = request_id
+    return json_response
+
+def cache_prediction(image_hash: str, model_version: str, model_name: str,
+                     result: Dict[str, Any], tier: ServiceTier) -> None:
+    """Store a fresh prediction; only full-quality tier results are shared"""
+    if result_cache is None or tier is not qos_controller.tiers[0]:
+        return
+    result_cache.set(cache_key(image_hash, model_version), {
+        "class_name": result["class_name"],
+        "confidence": result["confidence"],
+        "top_3": result["top_3"],
+        "model_name": model_name,
+        "model_version": model_version,
+    })
+
+def schedule_cache_prediction(*args) -> None:
+    """cache_prediction on a worker thread - a slow or unreachable cache never delays the response"""
+    if result_cache is not None:
+        asyncio.get_running_loop().run_in_executor(None, cache_prediction, *args)
+
+# ============================================================================
+# PRE-MODEL LEAF FILTER (short-circuits dark / blank / blurry / non-plant images)
+# ============================================================================
+def _env_threshold(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+leaf_filter = LeafFilter(
+    enabled=os.getenv("LEAF_FILTER_ENABLED", "false").lower() in ("1", "true", "yes"),
+    max_dark_ratio=_env_threshold("LEAF_FILTER_MAX_DARK_RATIO", DEFAULT_MAX_DARK_RATIO),
+    max_bright_ratio=_env_threshold("LEAF_FILTER_MAX_BRIGHT_RATIO", DEFAULT_MAX_BRIGHT_RATIO),
+    min_contrast=_env_threshold("LEAF_FILTER_MIN_CONTRAST", DEFAULT_MIN_CONTRAST),
+    min_sharpness=_env_threshold("LEAF_FILTER_MIN_SHARPNESS", DEFAULT_MIN_SHARPNESS),
+    min_plant_ratio=_env_threshold("LEAF_FILTER_MIN_PLANT_RATIO", DEFAULT_MIN_PLANT_RATIO),
+    quality_max_plant_ratio=_env_threshold("LEAF_FILTER_QUALITY_MAX_PLANT_RATIO", DEFAULT_QUALITY_MAX_PLANT_RATIO),
+)
+# Recorded as the model_version of rejected images, so history shows which thresholds decided
+LEAF_FILTER_VERSION = (
+    f"leaf-filter@{hashlib.sha256(repr(sorted(leaf_filter.thresholds().items())).encode()).hexdigest()[:12]}"
+)
+logger.info(f"Leaf pre-filter: {'enabled' if leaf_filter.enabled else 'disabled'} {leaf_filter.thresholds()}")
+
+def prefilter_result(check: LeafFilterResult) -> Dict[str, Any]:
+    """
+    class_name / confidence / top_3 for an image the leaf filter rejected. No model
+    ran, so confidence is 0.0 rather than a made-up certainty; `prefilter` says why.
+    """
+    return {
+        "class_name": REJECT_CLASS,
+        "confidence": 0.0,
+        "top_3": [{"class": REJECT_CLASS, "confidence": 0.0}],
+        "prefilter": check.to_dict(),
+    }
+
+def prefilter_response(
+    check: LeafFilterResult,
+    request_id: str,
+    start_time: float,
+    preprocess_time: float,
+    image_hash: str,
+    tier: ServiceTier,
+    model_name: str,
+    user_id: Optional[str],
+    plot_id: Optional[str],
+) -> JSONResponse:
+    """Response for an image rejected before the model; still recorded in the prediction history"""
+    result = prefilter_result(check)
+    total_time = time.time() - start_time
+    prediction_store.record(
+        image_hash=image_hash,
+        class_name=result["class_name"],
+        confidence=result["confidence"],
+        top_k=result["top_3"],
+        model_version=LEAF_FILTER_VERSION,
+        latency_ms=round(total_time * 1000, 2),
+        user_id=user_id,
+        plot_id=plot_id,
+        request_id=request_id,
+    )
+    logger.info(f"⏭️ Leaf pre-filter rejected {image_hash[:8]} ({check.reason}) - model skipped")
+    response = {
+        **result,
+        "metadata": {
+            "request_id": request_id,
+            "timestamp": time.time(),
+            "processing_time_ms": round(total_time * 1000, 2),
+            "preprocessing_time_ms": round(preprocess_time * 1000, 2),
+            "model_name": model_name,
+            "model_version": LEAF_FILTER_VERSION,
+            "qos_tier": tier.name,
+            "cache_hit": False,
+            "is_real_prediction": False,
+            "prediction_source": "leaf_prefilter",
+        },
+    }
+    json_response = JSONResponse(content=response)
+    json_response.headers["Cache-Control"] = "no-store"
+    json_response.headers["X-Prediction-Source"] = "leaf-prefilter"
+    json_response.headers["X-Request-ID"] = request_id
+    return json_response
+
+# ============================================================================
+# ADAPTIVE QUALITY OF SERVICE
+# ============================================================================
+def _env_list(name: str, default: str, cast=float):
+    return [cast(v) for v in os.getenv(name, default).split(",") if v.strip()]
+
+qos_controller = AdaptiveQoSController(
+    queue_depth_thresholds=_env_list("QOS_QUEUE_DEPTH_THRESHOLDS", "8,32", int),
+    latency_thresholds_ms=_env_list("QOS_LATENCY_THRESHOLDS_MS", "800,2000"),
+    recover_ratio=float(os.getenv("QOS_RECOVER_RATIO", "0.5")),
+    min_dwell_seconds=float(os.getenv("QOS_MIN_DWELL_SECONDS", "5")),
+    latency_half_life_seconds=float(os.getenv("QOS_LATENCY_HALF_LIFE_SECONDS", "10")),
+    enabled=os.getenv("QOS_ENABLED", "true").lower() in ("1", "true", "yes"),
+)
+
 # ============================================================================
 # FASTAPI APP INITIALIZATION
 # ============================================================================
@@ -234,23 +707,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def feeds_qos_latency(path: str) -> bool:
+    """
+    Single-image endpoints only. Tiled images and raw batches take seconds by
+    design and would push every farmer into a cheaper tier on one upload.
+    """
+    return path == "/predict" or (path.startswith("/models/") and path.endswith("/predict"))
+
+@app.middleware("http")
+async def track_prediction_load(request: Request, call_next):
+    """Feed queue depth (all prediction requests) and latency (single-image ones) to the QoS controller"""
+    path = request.url.path
+    if not (path.startswith("/predict") or path.endswith("/predict")):
+        return await call_next(request)
+    tier = qos_controller.request_started()
+    request.state.qos_tier = tier
+    request.state.qos_excluded_ms = 0.0  # handlers add time that isn't serving load (cold model loads)
+    start = time.time()
+    try:
+        response = await call_next(request)
+    finally:
+        latency_ms = None
+        if feeds_qos_latency(path):
+            latency_ms = max(0.0, (time.time() - start) * 1000 - request.state.qos_excluded_ms)
+        qos_controller.request_finished(latency_ms)
+    response.headers["X-QoS-Tier"] = tier.name
+    return response
+
+def request_tier(request: Request) -> ServiceTier:
+    return getattr(request.state, "qos_tier", None) or qos_controller.current_tier()
+
+@app.on_event("startup")
+async def start_background_workers():
+    prediction_store.start()
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    # Finish in-progress job batches, then flush queued history rows
+    job_queue.stop()
+    prediction_store.stop()
+
 # ============================================================================
 # PREDICTION ENDPOINT
 # ============================================================================
 @app.post("/predict")
-async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
+async def predict_disease(
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: Optional[str] = Form(None),
+    plot_id: Optional[str] = Form(None),
+) -> Dict[str, Any]:
     """
     Predict plant disease from uploaded image
     Uses REAL Keras model - NO MOCK DATA
+    Optional user_id / plot_id form fields are stored with the prediction history.
     """
     request_id = f"REQ_{int(time.time() * 1000)}"
     start_time = time.time()
+    tier = request_tier(request)
+    active_model = model_for_tier(tier)
     
     logger.info("")
     logger.info("=" * 70)
     logger.info(f"📥 NEW PREDICTION REQUEST: {request_id}")
     logger.info(f"   File: {file.filename}")
     logger.info(f"   Content Type: {file.content_type}")
+    logger.info(f"   QoS Tier: {tier.name}")
     logger.info("-" * 70)
     
     # Validate file type
@@ -264,23 +787,48 @@ async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
         image_bytes = await file.read()
         logger.info(f"   ✅ Read {len(image_bytes)} bytes")
         
-        # Step 2: Preprocess image
-        logger.info("Step 2: Preprocessing image...")
-        processed_image = preprocess_image(image_bytes)
-        logger.info(f"   ✅ Preprocessed: {processed_image.shape}")
-        
-        # Step 3: Make prediction using REAL model
-        logger.info("Step 3: Making prediction with Keras model...")
-        logger.info("   ⚠️ CALLING model.predict() - THIS IS THE REAL MODEL!")
-        logger.info("   ⚠️ NOT USING MOCK DATA!")
-        
-        prediction_start = time.time()
-        
-        # CRITICAL: This is the actual model prediction
-        # Use predict_on_batch for more control, or ensure we're not caching
-        predictions = model.predict(processed_image, verbose=0)
+        # Shared result cache: identical bytes + same model version = same answer.
+        # Only full-quality results are stored, so look them up under MODEL_VERSION
+        # in every tier - under overload a cached full answer beats a quantized one
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        if result_cache is not None:
+            cached = await run_in_threadpool(result_cache.get, cache_key(image_hash, MODEL_VERSION))
+            if cached is not None:
+                return cached_prediction_response(
+                    cached, request_id, start_time, image_hash, tier, user_id, plot_id
+                )
         
-        prediction_time = time.time() - prediction_start
+        # Step 2: Preprocess image straight into a pooled input buffer
+        logger.info("Step 2: Preprocessing image...")
+        with buffer_pool.acquire(1, TARGET_SIZE) as processed_image:
+            preprocess_start = time.time()
+            preprocess_image_into(
+                image_bytes, processed_image[0], resample=tier.resample, draft_decode=tier.draft_decode
+            )
+            preprocess_time = time.time() - preprocess_start
+            logger.info(f"   ✅ Preprocessed: {processed_image.shape}")
+            
+            # Step 2b: Cheap pre-filter - obvious non-leaf images never reach the model
+            check = leaf_filter.check(processed_image[0])
+            if not check.passed:
+                return prefilter_response(
+                    check, request_id, start_time, preprocess_time, image_hash, tier,
+                    DEFAULT_MODEL_NAME, user_id, plot_id,
+                )
+            
+            # Step 3: Make prediction using REAL model
+            logger.info("Step 3: Making prediction with Keras model...")
+            logger.info("   ⚠️ CALLING model.predict_on_batch() - THIS IS THE REAL MODEL!")
+            logger.info("   ⚠️ NOT USING MOCK DATA!")
+            
+            prediction_start = time.time()
+            
+            # CRITICAL: This is the actual model prediction
+            # predict_on_batch skips predict()'s per-call dataset pipeline and returns
+            # a fresh array, so the input buffer can go back to the pool right after
+            predictions = np.asarray(active_model.predict_on_batch(processed_image), dtype=np.float32)
+            
+            prediction_time = time.time() - prediction_start
         
         logger.info(f"   ✅ Prediction completed in {prediction_time:.3f}s")
         logger.info(f"   Prediction shape: {predictions.shape}")
@@ -289,19 +837,17 @@ async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
         
         # Step 4: Process prediction results
         logger.info("Step 4: Processing prediction results...")
-        pred_array = predictions[0].copy()  # Make a copy to avoid any reference issues
+        pred_array = predictions[0]  # view - the output array is ours, no copy needed
         
         # Check if predictions are logits (need softmax) or probabilities
         # If sum is close to 1, they're already probabilities
         pred_sum = np.sum(pred_array)
         logger.info(f"   Prediction sum (before processing): {pred_sum:.6f}")
         
-        # If sum is not close to 1, apply softmax
+        # If sum is not close to 1, apply softmax (in place)
         if abs(pred_sum - 1.0) > 0.01:
             logger.info("   Applying softmax (predictions appear to be logits)...")
-            # Apply softmax
-            exp_preds = np.exp(pred_array - np.max(pred_array))  # Subtract max for numerical stability
-            pred_array = exp_preds / np.sum(exp_preds)
+            softmax_in_place(predictions[:1])
             logger.info(f"   Prediction sum (after softmax): {np.sum(pred_array):.6f}")
         else:
             logger.info("   Predictions already appear to be probabilities (sum ≈ 1)")
@@ -351,9 +897,7 @@ async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
         logger.info(f"   ✅ Top prediction: Index={top_idx}, Class={class_name}, Confidence={top_confidence:.6f}")
         
         # Log input image hash to verify different images are being processed
-        import hashlib
-        image_hash = hashlib.md5(image_bytes).hexdigest()[:8]
-        logger.info(f"   Image hash (first 8 chars): {image_hash}")
+        logger.info(f"   Image hash (first 8 chars): {image_hash[:8]}")
         
         # Get top 3
         top_3_indices = np.argsort(pred_array[:len(CLASS_NAMES)])[-3:][::-1]
@@ -375,10 +919,15 @@ async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
                 "request_id": request_id,
                 "timestamp": time.time(),
                 "processing_time_ms": round(total_time * 1000, 2),
+                "preprocessing_time_ms": round(preprocess_time * 1000, 2),
                 "prediction_time_ms": round(prediction_time * 1000, 2),
                 "model_file": "plant_disease_recog_model_pwp.keras",
+                "model_version": model_version_of(active_model),
                 "model_input_shape": str(processed_image.shape),
                 "model_output_shape": str(predictions.shape),
+                "qos_tier": tier.name,
+                "quantized_model": active_model is quantized_model,
+                "cache_hit": False,
                 "is_real_prediction": True,
                 "prediction_source": "keras_model"
             }
@@ -393,6 +942,22 @@ async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
         logger.info(f"   ⚠️ THIS IS REAL PREDICTION FROM KERAS MODEL - NOT MOCK!")
         logger.info("=" * 70)
         
+        model_manager.record_request(DEFAULT_MODEL_NAME, total_time * 1000)
+        schedule_cache_prediction(image_hash, model_version_of(active_model), DEFAULT_MODEL_NAME, response, tier)
+        
+        # Persist to history (write-behind - never blocks the response)
+        prediction_store.record(
+            image_hash=image_hash,
+            class_name=class_name,
+            confidence=top_confidence,
+            top_k=top_3_predictions,
+            model_version=model_version_of(active_model),
+            latency_ms=response["metadata"]["processing_time_ms"],
+            user_id=user_id,
+            plot_id=plot_id,
+            request_id=request_id,
+        )
+        
         # Return response
         json_response = JSONResponse(content=response)
         json_response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
@@ -417,6 +982,626 @@ async def predict_disease(file: UploadFile = File(...)) -> Dict[str, Any]:
             detail=f"Prediction failed: {str(e)}"
         )
 
+# ============================================================================
+# RAW TENSOR ENDPOINT
+# ============================================================================
+def predict_raw_batch(body: bytes, active_model) -> Dict[str, Any]:
+    """
+    Blocking part of /predict/raw: parse the frames (400 on a bad payload),
+    run them through the model and hash each frame's pixels for the history
+    (for a single raw frame that is the hash of the body).
+    """
+    decode_start = time.time()
+    try:
+        frames = parse_raw_frames(body)
+    except ValueError as e:
+        logger.error(f"❌ Invalid raw payload: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid raw payload: {str(e)}")
+    decode_time = time.time() - decode_start
+
+    prediction_start = time.time()
+    probabilities = to_probabilities(active_model.predict_on_batch(preprocess_input(frames)))
+    prediction_time = time.time() - prediction_start
+    return {
+        "frames": frames,
+        "predictions": [build_prediction(row) for row in probabilities],
+        "image_hashes": [hashlib.sha256(frame).hexdigest() for frame in frames],
+        "decode_time": decode_time,
+        "prediction_time": prediction_time,
+    }
+
+@app.post("/predict/raw")
+async def predict_raw(
+    request: Request,
+    user_id: Optional[str] = None,
+    plot_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Predict from pre-resized uint8 pixels - skips image decoding entirely.
+
+    Body: raw 160x160x3 RGB bytes (optionally several frames back to back)
+    or a .npy array of shape (160, 160, 3) / (N, 160, 160, 3), dtype uint8.
+    A single frame returns the same shape as /predict; a batch returns
+    a `predictions` list in input order. user_id / plot_id (query parameters)
+    tag the history records, one per frame.
+    """
+    request_id = f"RAW_{int(time.time() * 1000)}"
+    start_time = time.time()
+    tier = request_tier(request)
+    active_model = model_for_tier(tier)
+
+    body = await read_raw_body(request)
+    try:
+        # Parse, batch inference (up to RAW_MAX_BATCH frames) and hashing - off the event loop
+        batch = await run_in_threadpool(predict_raw_batch, body, active_model)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ RAW PREDICTION ERROR: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    frames, predictions = batch["frames"], batch["predictions"]
+    decode_time, prediction_time = batch["decode_time"], batch["prediction_time"]
+
+    total_time = time.time() - start_time
+    logger.info(
+        f"✅ Raw prediction {request_id}: {len(frames)} frame(s) in {total_time * 1000:.1f}ms "
+        f"(decode {decode_time * 1000:.2f}ms)"
+    )
+
+    version = model_version_of(active_model)
+    for index, (image_hash, prediction) in enumerate(zip(batch["image_hashes"], predictions)):
+        prediction_store.record(
+            image_hash=image_hash,
+            class_name=prediction["class_name"],
+            confidence=prediction["confidence"],
+            top_k=prediction["top_3"],
+            model_version=version,
+            latency_ms=round(total_time * 1000, 2),
+            user_id=user_id,
+            plot_id=plot_id,
+            request_id=request_id if len(frames) == 1 else f"{request_id}_{index}",
+        )
+
+    metadata = {
+        "request_id": request_id,
+        "timestamp": time.time(),
+        "processing_time_ms": round(total_time * 1000, 2),
+        "preprocessing_time_ms": round(decode_time * 1000, 3),
+        "prediction_time_ms": round(prediction_time * 1000, 2),
+        "model_version": version,
+        "model_input_shape": str(frames.shape),
+        "qos_tier": tier.name,
+        "quantized_model": active_model is quantized_model,
+        "is_real_prediction": True,
+        "prediction_source": "keras_model_raw",
+    }
+    if len(predictions) == 1:
+        response = {**predictions[0], "metadata": metadata}
+    else:
+        response = {"predictions": predictions, "metadata": metadata}
+
+    json_response = JSONResponse(content=response)
+    json_response.headers["Cache-Control"] = "no-store"
+    json_response.headers["X-Request-ID"] = request_id
+    return json_response
+
+# ============================================================================
+# TILED INFERENCE ENDPOINT (large field / drone images)
+# ============================================================================
+TILED_MAX_SIDE = int(os.getenv("TILED_MAX_SIDE", "4096"))
+TILED_MAX_TILES = int(os.getenv("TILED_MAX_TILES", "4096"))
+TILED_BATCH_SIZE = int(os.getenv("TILED_BATCH_SIZE", "128"))
+
+def tile_batch_predictor(active_model):
+    """predict_fn for run_tiled_inference: raw 0-255 tiles -> probabilities"""
+    def predict_tile_batch(batch: np.ndarray) -> np.ndarray:
+        return to_probabilities(active_model.predict_on_batch(preprocess_input(batch)))
+    return predict_tile_batch
+
+@app.post("/predict/tiled")
+async def predict_tiled(
+    request: Request,
+    file: UploadFile = File(...),
+    overlap: float = Form(0.25),
+    include_tiles: bool = Form(True),
+) -> Dict[str, Any]:
+    """
+    Tiled inference for large images: overlapping 160x160 tiles, empty tiles
+    skipped, remaining tiles batched through the model. Returns per-tile
+    classes, a disease-coverage summary and a compact heatmap.
+    """
+    request_id = f"TILED_{int(time.time() * 1000)}"
+    start_time = time.time()
+    tier = request_tier(request)
+    active_model = model_for_tier(tier)
+
+    logger.info("")
+    logger.info("=" * 70)
+    logger.info(f"📥 NEW TILED PREDICTION REQUEST: {request_id}")
+    logger.info(f"   File: {file.filename}, overlap: {overlap}")
+
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    if not 0.0 <= overlap <= 0.9:
+        raise HTTPException(status_code=400, detail="overlap must be between 0 and 0.9")
+
+    image_bytes = await file.read()
+    try:
+        img_array = await run_in_threadpool(
+            load_image_for_tiling, image_bytes, max_side=TILED_MAX_SIDE, tile=TARGET_SIZE[0]
+        )
+    except Exception as e:
+        logger.error(f"❌ Image decode error: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+
+    try:
+        # Decoding and up to TILED_MAX_TILES tiles of inference - keep it off the event loop
+        result = await run_in_threadpool(
+            run_tiled_inference,
+            img_array,
+            tile_batch_predictor(active_model),
+            CLASS_NAMES,
+            overlap=overlap,
+            batch_size=TILED_BATCH_SIZE * tier.batch_multiplier,
+            max_tiles=TILED_MAX_TILES,
+            include_tiles=include_tiles,
+            tile=TARGET_SIZE[0],
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ TILED PREDICTION ERROR: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Tiled prediction failed: {str(e)}")
+
+    perf = result["performance"]
+    logger.info(
+        f"✅ Tiled prediction: {result['tiling']['analyzed_tiles']}/{result['tiling']['total_tiles']} tiles, "
+        f"coverage={result['summary']['disease_coverage']:.2%}, "
+        f"{perf['tiles_per_second']} tiles/s in {perf['model_calls']} model calls"
+    )
+
+    result["metadata"] = {
+        "request_id": request_id,
+        "timestamp": time.time(),
+        "processing_time_ms": round((time.time() - start_time) * 1000, 2),
+        "model_version": model_version_of(active_model),
+        "qos_tier": tier.name,
+        "quantized_model": active_model is quantized_model,
+        "is_real_prediction": True,
+        "prediction_source": "keras_model_tiled",
+    }
+    json_response = JSONResponse(content=result)
+    json_response.headers["Cache-Control"] = "no-store"
+    json_response.headers["X-Request-ID"] = request_id
+    return json_response
+
+# ============================================================================
+# MULTI-MODEL ENDPOINTS
+# ============================================================================
+@app.get("/models")
+async def list_models() -> Dict[str, Any]:
+    """Registered models, their routes, load state, memory and latency"""
+    return model_manager.stats()
+
+def run_model_prediction(loaded: LoadedModel, image_bytes: bytes, tier: ServiceTier) -> Dict[str, Any]:
+    """
+    Blocking part of /models/{name}/predict: decode into a pooled buffer, run
+    the leaf filter and, if it passes, the model. Raises HTTPException(400)
+    for an unreadable image.
+    """
+    with buffer_pool.acquire(1, loaded.input_size) as processed_image:
+        preprocess_start = time.time()
+        preprocess_image_into(
+            image_bytes, processed_image[0], resample=tier.resample, draft_decode=tier.draft_decode
+        )
+        preprocess_time = time.time() - preprocess_start
+        outcome = {
+            "check": leaf_filter.check(processed_image[0]),
+            "preprocess_time": preprocess_time,
+            "input_shape": str(processed_image.shape),
+        }
+        if not outcome["check"].passed:
+            return outcome
+
+        prediction_start = time.time()
+        probabilities = to_probabilities(loaded.model.predict_on_batch(processed_image))
+        outcome["prediction_time"] = time.time() - prediction_start
+    outcome["result"] = build_prediction(probabilities[0], loaded.class_names)
+    return outcome
+
+@app.post("/models/{name}/predict")
+async def predict_with_model(
+    name: str,
+    request: Request,
+    file: UploadFile = File(...),
+    user_id: Optional[str] = Form(None),
+    plot_id: Optional[str] = Form(None),
+) -> Dict[str, Any]:
+    """
+    Predict with a specific model, addressed by name or route alias
+    (e.g. /models/tomato/predict). The model is loaded on first use.
+    """
+    request_id = f"REQ_{int(time.time() * 1000)}"
+    start_time = time.time()
+    tier = request_tier(request)
+
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    try:
+        # Loading can take seconds - keep it off the event loop, and out of the QoS latency signal
+        load_start = time.time()
+        loaded = await run_in_threadpool(model_manager.get, name)
+        request.state.qos_excluded_ms = (time.time() - load_start) * 1000
+    except ModelNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown model or route: {name}")
+    except Exception as e:
+        logger.error(f"❌ Failed to load model '{name}': {e}")
+        raise HTTPException(status_code=503, detail=f"Model '{name}' could not be loaded: {str(e)}")
+
+    logger.info(f"📥 NEW PREDICTION REQUEST: {request_id} (model={loaded.name}, tier={tier.name})")
+    image_bytes = await file.read()
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    if result_cache is not None:
+        cached = await run_in_threadpool(result_cache.get, cache_key(image_hash, loaded.version))
+        if cached is not None:
+            return cached_prediction_response(cached, request_id, start_time, image_hash, tier, user_id, plot_id)
+
+    try:
+        # Decode, leaf filter and inference all block - run them off the event loop
+        outcome = await run_in_threadpool(run_model_prediction, loaded, image_bytes, tier)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ PREDICTION ERROR ({loaded.name}): {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    preprocess_time = outcome["preprocess_time"]
+    if not outcome["check"].passed:
+        return prefilter_response(
+            outcome["check"], request_id, start_time, preprocess_time, image_hash, tier, loaded.name, user_id, plot_id
+        )
+    result, prediction_time = outcome["result"], outcome["prediction_time"]
+
+    total_time = time.time() - start_time
+    model_manager.record_request(loaded.name, total_time * 1000)
+    schedule_cache_prediction(image_hash, loaded.version, loaded.name, result, tier)
+    logger.info(
+        f"✅ {loaded.name}: {result['class_name']} ({result['confidence']*100:.2f}%) in {total_time:.3f}s"
+    )
+
+    prediction_store.record(
+        image_hash=image_hash,
+        class_name=result["class_name"],
+        confidence=result["confidence"],
+        top_k=result["top_3"],
+        model_version=loaded.version,
+        latency_ms=round(total_time * 1000, 2),
+        user_id=user_id,
+        plot_id=plot_id,
+        request_id=request_id,
+    )
+
+    response = {
+        **result,
+        "metadata": {
+            "request_id": request_id,
+            "timestamp": time.time(),
+            "processing_time_ms": round(total_time * 1000, 2),
+            "preprocessing_time_ms": round(preprocess_time * 1000, 2),
+            "prediction_time_ms": round(prediction_time * 1000, 2),
+            "model_name": loaded.name,
+            "model_file": loaded.spec.path.name,
+            "model_version": loaded.version,
+            "model_input_shape": outcome["input_shape"],
+            "qos_tier": tier.name,
+            "cache_hit": False,
+            "is_real_prediction": True,
+            "prediction_source": "keras_model",
+        },
+    }
+    json_response = JSONResponse(content=response)
+    json_response.headers["Cache-Control"] = "no-store"
+    json_response.headers["X-Request-ID"] = request_id
+    return json_response
+
+# ============================================================================
+# ASYNCHRONOUS JOB API (submit / poll for slow or unstable clients)
+# ============================================================================
+JOB_DB_PATH = Path(os.getenv("JOB_DB_PATH", str(BASE_DIR / "jobs.db")))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "16"))
+JOB_MAX_IMAGE_BYTES = int(float(os.getenv("JOB_MAX_IMAGE_MB", "20")) * 1024 * 1024)
+
+def process_job_batch(jobs: List[Job]) -> List[Any]:
+    """
+    Run one batch of queued jobs (all for the same model) through a single
+    model call. Returns a result dict or an exception per job; ValueError
+    marks a permanent failure (bad image) that is not retried.
+    """
+    start_time = time.time()
+    loaded = model_manager.get(jobs[0].model_name)
+    tier = qos_controller.current_tier()
+
+    results: List[Any] = [None] * len(jobs)
+    indices = []
+    with buffer_pool.acquire(len(jobs), loaded.input_size) as batch:
+        # Decode each image into the next free row; failed or pre-filtered images leave no gap
+        for i, job in enumerate(jobs):
+            try:
+                preprocess_image_into(
+                    job.image, batch[len(indices)], resample=tier.resample, draft_decode=tier.draft_decode
+                )
+            except HTTPException as e:
+                results[i] = ValueError(e.detail)
+                continue
+            check = leaf_filter.check(batch[len(indices)])
+            if check.passed:
+                indices.append(i)
+                continue
+            result = prefilter_result(check)
+            latency_ms = round((time.time() - job.created_at) * 1000, 2)
+            results[i] = {
+                **result,
+                "metadata": {
+                    "request_id": f"JOB_{job.id}",
+                    "timestamp": time.time(),
+                    "end_to_end_time_ms": latency_ms,
+                    "model_name": loaded.name,
+                    "model_version": LEAF_FILTER_VERSION,
+                    "qos_tier": tier.name,
+                    "is_real_prediction": False,
+                    "prediction_source": "leaf_prefilter",
+                },
+            }
+            prediction_store.record(
+                image_hash=hashlib.sha256(job.image).hexdigest(),
+                class_name=result["class_name"],
+                confidence=result["confidence"],
+                top_k=result["top_3"],
+                model_version=LEAF_FILTER_VERSION,
+                latency_ms=latency_ms,
+                user_id=job.user_id,
+                plot_id=job.plot_id,
+                request_id=f"JOB_{job.id}",
+            )
+
+        if indices:
+            prediction_start = time.time()
+            probabilities = to_probabilities(loaded.model.predict_on_batch(batch[:len(indices)]))
+            prediction_time = time.time() - prediction_start
+
+    if indices:
+        for row, i in zip(probabilities, indices):
+            job = jobs[i]
+            try:
+                result = build_prediction(row, loaded.class_names)
+            except HTTPException as e:
+                results[i] = RuntimeError(e.detail)
+                continue
+            latency_ms = round((time.time() - job.created_at) * 1000, 2)
+            results[i] = {
+                **result,
+                "metadata": {
+                    "request_id": f"JOB_{job.id}",
+                    "timestamp": time.time(),
+                    "batch_size": len(indices),
+                    "prediction_time_ms": round(prediction_time * 1000, 2),
+                    "end_to_end_time_ms": latency_ms,
+                    "model_name": loaded.name,
+                    "model_version": loaded.version,
+                    "qos_tier": tier.name,
+                    "is_real_prediction": True,
+                    "prediction_source": "keras_model_job",
+                },
+            }
+            prediction_store.record(
+                image_hash=hashlib.sha256(job.image).hexdigest(),
+                class_name=result["class_name"],
+                confidence=result["confidence"],
+                top_k=result["top_3"],
+                model_version=loaded.version,
+                latency_ms=latency_ms,
+                user_id=job.user_id,
+                plot_id=job.plot_id,
+                request_id=f"JOB_{job.id}",
+            )
+
+    model_manager.record_request(loaded.name, (time.time() - start_time) * 1000)
+    logger.info(f"✅ Job batch: {len(indices)}/{len(jobs)} image(s) with '{loaded.name}' in {time.time() - start_time:.3f}s")
+    return results
+
+job_queue = JobQueue(
+    JOB_DB_PATH,
+    process_job_batch,
+    num_workers=int(os.getenv("JOB_WORKERS", "2")),
+    # Cheaper QoS tiers also drain the job queue in bigger batches
+    batch_size=lambda: JOB_BATCH_SIZE * qos_controller.current_tier().batch_multiplier,
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+    retention_seconds=float(os.getenv("JOB_RETENTION_HOURS", "24")) * 3600,
+    lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "300")),
+    callback_max_attempts=int(os.getenv("JOB_CALLBACK_MAX_ATTEMPTS", "4")),
+    callback_allowed_hosts=os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(","),
+)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    model: str = Form(DEFAULT_MODEL_NAME),
+    callback_url: Optional[str] = Form(None),
+    user_id: Optional[str] = Form(None),
+    plot_id: Optional[str] = Form(None),
+) -> Dict[str, Any]:
+    """
+    Store an image for background prediction and return a job ID immediately.
+    Poll GET /jobs/{job_id}; if callback_url is given the result is also POSTed there.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    try:
+        model_name = model_manager.resolve(model)
+    except ModelNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown model or route: {model}")
+
+    image_bytes = await file.read()
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty file")
+    if len(image_bytes) > JOB_MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image larger than {JOB_MAX_IMAGE_BYTES} bytes")
+
+    try:
+        job = await run_in_threadpool(
+            job_queue.submit, image_bytes, model_name,
+            content_type=file.content_type, callback_url=callback_url, user_id=user_id, plot_id=plot_id,
+        )
+    except CallbackURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"📥 Job queued: {job['job_id']} (model={model_name}, {len(image_bytes)} bytes)")
+    return {**job, "model": model_name, "status_url": f"/jobs/{job['job_id']}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    """Job status; `result` holds the prediction once status is 'done'"""
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+# ============================================================================
+# PREDICTION HISTORY ENDPOINTS
+# ============================================================================
+@app.get("/history")
+async def prediction_history(
+    user_id: Optional[str] = None,
+    plot_id: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """Prediction history for a user and/or plot, newest first"""
+    if user_id is None and plot_id is None:
+        raise HTTPException(status_code=400, detail="user_id or plot_id is required")
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+
+    # SQLite query - run it in the threadpool so it never blocks the event loop
+    items = await run_in_threadpool(
+        prediction_store.history, user_id=user_id, plot_id=plot_id, since=since, until=until, limit=limit
+    )
+    return {"user_id": user_id, "plot_id": plot_id, "count": len(items), "predictions": items}
+
+@app.get("/history/disease-counts")
+async def disease_counts(
+    window_hours: float = 24 * 7,
+    until: Optional[float] = None,
+    user_id: Optional[str] = None,
+    plot_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Number of predictions per disease class over a time window"""
+    if window_hours <= 0:
+        raise HTTPException(status_code=400, detail="window_hours must be positive")
+
+    window_end = until if until is not None else time.time()
+    window_start = window_end - window_hours * 3600
+    counts = await run_in_threadpool(
+        prediction_store.disease_counts, since=window_start, until=window_end, user_id=user_id, plot_id=plot_id
+    )
+    return {
+        "window_start": window_start,
+        "window_end": window_end,
+        "user_id": user_id,
+        "plot_id": plot_id,
+        "total": sum(c["count"] for c in counts),
+        "counts": counts,
+    }
+
+# ============================================================================
+# ADMIN: ON-DEMAND PROFILING
+# ============================================================================
+ADMIN_TOKEN = os.getenv("FARMIQ_ADMIN_TOKEN")
+
+profiler_service = ProfilerService(
+    Path(os.getenv("PROFILE_OUTPUT_DIR", str(BASE_DIR / "profiles"))),
+    max_seconds=float(os.getenv("PROFILE_MAX_SECONDS", "30")),
+    cooldown_seconds=float(os.getenv("PROFILE_COOLDOWN_SECONDS", "60")),
+    max_files=int(os.getenv("PROFILE_MAX_FILES", "20")),
+)
+
+def require_admin(token: Optional[str]) -> None:
+    """Admin endpoints are disabled unless FARMIQ_ADMIN_TOKEN is set"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (FARMIQ_ADMIN_TOKEN not set)")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/profile")
+async def capture_profile(
+    seconds: float = 10.0,
+    python: bool = True,
+    tensorflow: bool = False,
+    interval_ms: Optional[float] = None,
+    top: int = 25,
+    x_admin_token: Optional[str] = Header(None),
+) -> Dict[str, Any]:
+    """
+    Profile the live server for a bounded time window (admin only).
+    Samples Python stacks of all threads and/or records a TensorFlow profiler
+    trace of model execution; output is written under PROFILE_OUTPUT_DIR and
+    the hottest functions / ops are returned.
+    """
+    require_admin(x_admin_token)
+    if not python and not tensorflow:
+        raise HTTPException(status_code=400, detail="Enable python and/or tensorflow profiling")
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds must be positive")
+
+    try:
+        # Runs in a worker thread so the server keeps serving (and being sampled) meanwhile
+        return await run_in_threadpool(
+            profiler_service.capture,
+            seconds,
+            python=python,
+            tensorflow=tensorflow,
+            interval=interval_ms / 1000 if interval_ms else None,
+            top_n=max(1, min(top, 100)),
+        )
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ProfilerCooldownError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after) + 1)})
+
+@app.get("/admin/profile")
+async def profile_status(x_admin_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+    """Profiler limits and whether a capture is running (admin only)"""
+    require_admin(x_admin_token)
+    return profiler_service.status()
+
+# ============================================================================
+# METRICS ENDPOINT
+# ============================================================================
+@app.get("/metrics")
+async def metrics() -> Dict[str, Any]:
+    """Runtime metrics for the inference server's background components"""
+    # Shared cache stats may hit Redis or scan the mmap table, and job stats query
+    # SQLite - keep both off the event loop
+    cache_stats = await run_in_threadpool(result_cache.stats) if result_cache is not None else {"backend": "none"}
+    job_stats = await run_in_threadpool(job_queue.stats)
+    return {
+        "server_time": time.time(),
+        "model_version": MODEL_VERSION,
+        "prediction_store": prediction_store.stats(),
+        "qos": {**qos_controller.stats(), "quantized_model_available": quantized_model is not None},
+        "models": model_manager.stats(),
+        "jobs": job_stats,
+        "result_cache": cache_stats,
+        "buffer_pool": buffer_pool.stats(),
+        "leaf_filter": leaf_filter.stats(),
+    }
+
 # ============================================================================
 # HEALTH CHECK ENDPOINT
 # ============================================================================
@@ -449,6 +1634,15 @@ async def root():
         "model_loaded": model is not None,
         "endpoints": {
             "predict": "/predict (POST)",
+            "predict_raw": "/predict/raw (POST)",
+            "predict_tiled": "/predict/tiled (POST)",
+            "models": "/models (GET)",
+            "predict_with_model": "/models/{name}/predict (POST)",
+            "submit_job": "/jobs (POST)",
+            "job_status": "/jobs/{job_id} (GET)",
+            "history": "/history (GET)",
+            "disease_counts": "/history/disease-counts (GET)",
+            "metrics": "/metrics (GET)",
             "health": "/health (GET)"
         },
         "model": {
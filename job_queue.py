@@ -0,0 +1,532 @@
+"""
+Asynchronous Prediction Jobs
+Durable, SQLite-backed job queue for clients on unstable connections.
+
+POST /jobs stores the upload and returns immediately; background worker
+threads claim pending jobs in batches (grouped by model), run inference and
+store the result for GET /jobs/{id}. Because the queue lives on disk, jobs
+survive a server restart. Every claim takes a lease: a job whose lease expires
+while still `running` (its worker crashed or hung) goes back to `pending`,
+while jobs that sibling workers are actively processing are left alone.
+
+Callbacks are delivered by separate threads with retries, so a slow or dead
+callback endpoint never holds up inference. Callback URLs that resolve to
+loopback, private, link-local or otherwise internal addresses are refused.
+"""
+import heapq
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id TEXT PRIMARY KEY,
+  status TEXT NOT NULL DEFAULT 'pending',
+  model_name TEXT NOT NULL,
+  image BLOB,
+  content_type TEXT,
+  user_id TEXT,
+  plot_id TEXT,
+  callback_url TEXT,
+  callback_status TEXT,
+  result TEXT,
+  error TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  created_at REAL NOT NULL,
+  started_at REAL,
+  finished_at REAL,
+  lease_owner TEXT,
+  lease_expires_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+# Columns added after the first release; ALTERed into existing databases
+LEASE_COLUMNS = {"lease_owner": "TEXT", "lease_expires_at": "REAL"}
+
+# Statuses: pending -> running -> done | failed  (running -> pending on retry or lease expiry)
+FINISHED_STATUSES = ("done", "failed")
+
+
+# ============================================================================
+# CALLBACK URL VALIDATION
+# ============================================================================
+class CallbackURLError(ValueError):
+    """callback_url is malformed or points at an address the server must not call."""
+
+
+def check_callback_url(url: str, allowed_hosts: Optional[frozenset] = None) -> None:
+    """
+    Refuse anything but http(s) URLs whose host resolves only to public addresses.
+    Hosts in allowed_hosts skip the address check (for callbacks into a known
+    internal service). Raises CallbackURLError.
+    """
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise CallbackURLError("callback_url must be an http(s) URL with a host")
+    host = parts.hostname.lower()
+    if allowed_hosts is not None:
+        if host not in allowed_hosts:
+            raise CallbackURLError(f"callback_url host '{host}' is not in the allowed list")
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 80, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError) as e:
+        raise CallbackURLError(f"callback_url host '{host}' does not resolve: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            raise CallbackURLError(f"callback_url host '{host}' resolves to non-public address {ip}")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """A redirect could point the callback at an internal address after validation"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+_callback_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class Job:
+    """One claimed job handed to the batch processor."""
+
+    def __init__(self, job_id: str, model_name: str, image: bytes, content_type: Optional[str],
+                 user_id: Optional[str], plot_id: Optional[str], created_at: float):
+        self.id = job_id
+        self.model_name = model_name
+        self.image = image
+        self.content_type = content_type
+        self.user_id = user_id
+        self.plot_id = plot_id
+        self.created_at = created_at
+
+
+# process_batch(jobs) -> one result dict or Exception per job, in order
+BatchProcessor = Callable[[List[Job]], List[Union[Dict[str, Any], Exception]]]
+
+
+class JobQueue:
+    """Durable job queue drained by a pool of batching worker threads."""
+
+    def __init__(
+        self,
+        db_path: Path,
+        process_batch: BatchProcessor,
+        num_workers: int = 2,
+        batch_size: Union[int, Callable[[], int]] = 16,
+        poll_interval: float = 0.2,
+        max_attempts: int = 3,
+        retention_seconds: float = 24 * 3600,
+        lease_seconds: float = 300.0,
+        callback_timeout: float = 10.0,
+        callback_workers: int = 2,
+        callback_max_attempts: int = 4,
+        callback_retry_delay: float = 5.0,
+        callback_allowed_hosts: Optional[List[str]] = None,
+    ):
+        self.db_path = Path(db_path)
+        self.process_batch = process_batch
+        self.num_workers = num_workers
+        self._batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.callback_timeout = callback_timeout
+        self.callback_workers = callback_workers
+        self.callback_max_attempts = callback_max_attempts
+        self.callback_retry_delay = callback_retry_delay
+        allowed = frozenset(host.strip().lower() for host in callback_allowed_hosts or () if host.strip())
+        self.callback_allowed_hosts = allowed or None  # None: any host with only public addresses
+        # Identifies this process's leases; a restarted server gets a new one
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._threads: List[threading.Thread] = []
+        self._callback_threads: List[threading.Thread] = []
+        self._stop_event = threading.Event()
+        self._callback_stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._queue_latencies_ms: deque = deque(maxlen=1000)
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "batches": 0, "leases_reclaimed": 0,
+            "worker_errors": 0, "callbacks_delivered": 0, "callbacks_retried": 0, "callbacks_failed": 0,
+        }
+        # (due time, attempt, job_id) min-heap drained by the callback threads
+        self._callbacks: List[Tuple[float, int, str]] = []
+        self._callback_cond = threading.Condition()
+        self._init_db()
+
+    # ------------------------------------------------------------------------
+    # Setup / lifecycle
+    # ------------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self) -> None:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in LEASE_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """
+        Start the workers. Jobs other processes still hold a lease on are not
+        touched; expired leases are reclaimed by the workers as they poll.
+        """
+        if self._threads:
+            return
+        self._stop_event.clear()
+        self._callback_stop_event.clear()
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for i in range(self.callback_workers):
+            thread = threading.Thread(target=self._callback_loop, name=f"job-callback-{i}", daemon=True)
+            thread.start()
+            self._callback_threads.append(thread)
+        logger.info(f"✅ Job queue started: {self.num_workers} worker(s), {self.db_path} (owner {self.owner})")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """
+        Let in-progress batches finish, deliver the callbacks that are already
+        due, then stop. Callbacks waiting for a retry are dropped (and logged).
+        """
+        self._stop_event.set()
+        self._wake_event.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        with self._callback_cond:
+            self._callback_stop_event.set()
+            self._callback_cond.notify_all()
+        for thread in self._callback_threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        self._callback_threads = []
+        if self._callbacks:
+            logger.warning(f"⚠️ {len(self._callbacks)} job callback(s) not delivered before shutdown")
+            self._callbacks = []
+        logger.info("Job queue stopped")
+
+    @property
+    def batch_size(self) -> int:
+        return max(1, int(self._batch_size() if callable(self._batch_size) else self._batch_size))
+
+    # ------------------------------------------------------------------------
+    # Submit / poll
+    # ------------------------------------------------------------------------
+    def submit(
+        self,
+        image: bytes,
+        model_name: str,
+        content_type: Optional[str] = None,
+        callback_url: Optional[str] = None,
+        user_id: Optional[str] = None,
+        plot_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Queue one image; raises CallbackURLError for a callback_url the server must not call"""
+        if callback_url:
+            check_callback_url(callback_url, self.callback_allowed_hosts)
+        job_id = uuid.uuid4().hex
+        created_at = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, model_name, image, content_type, user_id, plot_id, callback_url, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, model_name, sqlite3.Binary(image), content_type, user_id, plot_id, callback_url, created_at),
+            )
+        finally:
+            conn.close()
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+        self._wake_event.set()
+        return {"job_id": job_id, "status": "pending", "created_at": created_at}
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT id, status, model_name, user_id, plot_id, callback_url, callback_status, "
+                "result, error, attempts, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            position = None
+            if row is not None and row["status"] == "pending":
+                position = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND created_at < ?",
+                    (row["created_at"],),
+                ).fetchone()[0]
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["job_id"] = job.pop("id")
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["queue_position"] = position
+        if job["started_at"]:
+            job["queue_latency_ms"] = round((job["started_at"] - job["created_at"]) * 1000, 2)
+        return job
+
+    # ------------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------------
+    def _worker_loop(self) -> None:
+        conn = self._connect()
+        last_purge = 0.0
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    jobs = self._claim_batch(conn)
+                    if not jobs:
+                        if time.time() - last_purge > 600:
+                            self._purge(conn)
+                            last_purge = time.time()
+                        self._wake_event.wait(self.poll_interval)
+                        self._wake_event.clear()
+                        continue
+                    self._run_batch(conn, jobs)
+                except Exception as e:
+                    # e.g. sqlite3.OperationalError (database is locked) - claimed jobs
+                    # stay leased and are retried once the lease expires
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    with self._stats_lock:
+                        self._stats["worker_errors"] += 1
+                    logger.error(f"❌ Job worker error: {e}")
+                    self._stop_event.wait(self.poll_interval)
+        finally:
+            conn.close()
+
+    def _reclaim_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        """Put running jobs whose lease ran out back to pending (or fail them if out of attempts)"""
+        expired = "status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)"
+        exhausted = conn.execute(
+            f"UPDATE jobs SET status = 'failed', error = 'worker lease expired', finished_at = ?, image = NULL, "
+            f"lease_owner = NULL, lease_expires_at = NULL WHERE {expired} AND attempts >= ?",
+            (now, now, self.max_attempts),
+        ).rowcount
+        requeued = conn.execute(
+            f"UPDATE jobs SET status = 'pending', started_at = NULL, lease_owner = NULL, lease_expires_at = NULL "
+            f"WHERE {expired}",
+            (now,),
+        ).rowcount
+        if exhausted or requeued:
+            with self._stats_lock:
+                self._stats["leases_reclaimed"] += exhausted + requeued
+            logger.warning(f"⚠️ Reclaimed {exhausted + requeued} job(s) with expired leases "
+                           f"({requeued} re-queued, {exhausted} out of attempts)")
+
+    def _claim_batch(self, conn: sqlite3.Connection) -> List[Job]:
+        """Atomically lease up to batch_size pending jobs (same model) to this process"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            self._reclaim_expired(conn, now)
+            oldest = conn.execute(
+                "SELECT model_name FROM jobs WHERE status = 'pending' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if oldest is None:
+                conn.execute("COMMIT")
+                return []
+            rows = conn.execute(
+                "SELECT id, model_name, image, content_type, user_id, plot_id, created_at FROM jobs "
+                "WHERE status = 'pending' AND model_name = ? ORDER BY created_at LIMIT ?",
+                (oldest["model_name"], self.batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1, "
+                "lease_owner = ?, lease_expires_at = ? WHERE id = ?",
+                [(now, self.owner, now + self.lease_seconds, row["id"]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        with self._stats_lock:
+            for row in rows:
+                self._queue_latencies_ms.append((now - row["created_at"]) * 1000)
+        return [
+            Job(row["id"], row["model_name"], bytes(row["image"]), row["content_type"],
+                row["user_id"], row["plot_id"], row["created_at"])
+            for row in rows
+        ]
+
+    def _run_batch(self, conn: sqlite3.Connection, jobs: List[Job]) -> None:
+        try:
+            results = self.process_batch(jobs)
+        except Exception as e:
+            logger.error(f"❌ Job batch of {len(jobs)} failed: {e}")
+            results = [e] * len(jobs)
+
+        now = time.time()
+        done, failed, retry = [], [], []
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                attempts = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job.id,)).fetchone()[0]
+                if attempts < self.max_attempts and not isinstance(result, ValueError):
+                    retry.append((job.id,))
+                else:
+                    failed.append((str(result), now, job.id))
+            else:
+                done.append((json.dumps(result), now, job.id))
+
+        # Only rows this process still holds a lease on are written; a job whose
+        # lease expired mid-batch belongs to whoever reclaimed it
+        owned = "AND status = 'running' AND lease_owner = ?"
+        release = "lease_owner = NULL, lease_expires_at = NULL"
+        conn.execute("BEGIN IMMEDIATE")
+        # Finished jobs drop their image - only the result is kept
+        conn.executemany(
+            f"UPDATE jobs SET status = 'done', result = ?, finished_at = ?, image = NULL, {release} "
+            f"WHERE id = ? {owned}",
+            [(*row, self.owner) for row in done],
+        )
+        conn.executemany(
+            f"UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, image = NULL, {release} "
+            f"WHERE id = ? {owned}",
+            [(*row, self.owner) for row in failed],
+        )
+        conn.executemany(
+            f"UPDATE jobs SET status = 'pending', started_at = NULL, {release} WHERE id = ? {owned}",
+            [(*row, self.owner) for row in retry],
+        )
+        conn.execute("COMMIT")
+
+        with self._stats_lock:
+            self._stats["completed"] += len(done)
+            self._stats["failed"] += len(failed)
+            self._stats["batches"] += 1
+
+        for row in done + failed:
+            self._schedule_callback(row[-1], attempt=1, delay=0.0)
+
+    # ------------------------------------------------------------------------
+    # Callbacks (own threads, so a slow endpoint never stalls inference)
+    # ------------------------------------------------------------------------
+    def _schedule_callback(self, job_id: str, attempt: int, delay: float) -> None:
+        with self._callback_cond:
+            heapq.heappush(self._callbacks, (time.time() + delay, attempt, job_id))
+            self._callback_cond.notify()
+
+    def _callback_loop(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                with self._callback_cond:
+                    while not (self._callbacks and self._callbacks[0][0] <= time.time()):
+                        if self._callback_stop_event.is_set():
+                            return
+                        timeout = self._callbacks[0][0] - time.time() if self._callbacks else None
+                        self._callback_cond.wait(timeout)
+                    _, attempt, job_id = heapq.heappop(self._callbacks)
+                try:
+                    self._send_callback(conn, job_id, attempt)
+                except Exception as e:
+                    logger.error(f"❌ Callback worker error for job {job_id}: {e}")
+        finally:
+            conn.close()
+
+    def _send_callback(self, conn: sqlite3.Connection, job_id: str, attempt: int) -> None:
+        """One delivery attempt; failures are rescheduled with exponential backoff"""
+        job = self.get(job_id)
+        if not job or not job.get("callback_url"):
+            return
+        payload = json.dumps({k: job[k] for k in ("job_id", "status", "result", "error", "finished_at")})
+        request = urllib.request.Request(
+            job["callback_url"], data=payload.encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        retry = False
+        try:
+            # Re-checked at delivery: DNS may have changed since the job was submitted
+            check_callback_url(job["callback_url"], self.callback_allowed_hosts)
+            with _callback_opener.open(request, timeout=self.callback_timeout) as response:
+                status = f"delivered ({response.status})"
+            with self._stats_lock:
+                self._stats["callbacks_delivered"] += 1
+        except CallbackURLError as e:
+            status = f"refused: {e}"
+            with self._stats_lock:
+                self._stats["callbacks_failed"] += 1
+            logger.warning(f"⚠️ Callback for job {job_id} refused: {e}")
+        except Exception as e:
+            retry = attempt < self.callback_max_attempts
+            status = f"retrying (attempt {attempt}): {e}" if retry else f"failed after {attempt} attempt(s): {e}"
+            with self._stats_lock:
+                self._stats["callbacks_retried" if retry else "callbacks_failed"] += 1
+            logger.warning(f"⚠️ Callback for job {job_id} failed (attempt {attempt}): {e}")
+        conn.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+        if retry:
+            self._schedule_callback(job_id, attempt + 1, self.callback_retry_delay * 2 ** (attempt - 1))
+
+    def _purge(self, conn: sqlite3.Connection) -> None:
+        cutoff = time.time() - self.retention_seconds
+        purged = conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+            (*FINISHED_STATUSES, cutoff),
+        ).rowcount
+        if purged:
+            logger.info(f"Purged {purged} finished job(s) older than {self.retention_seconds / 3600:.0f}h")
+
+    # ------------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        try:
+            counts = {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+            oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        finally:
+            conn.close()
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._queue_latencies_ms)
+        with self._callback_cond:
+            callbacks_queued = len(self._callbacks)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2) if latencies else None
+
+        stats.update({
+            "workers": sum(thread.is_alive() for thread in self._threads),
+            "callback_workers": sum(thread.is_alive() for thread in self._callback_threads),
+            "callbacks_queued": callbacks_queued,
+            "batch_size": self.batch_size,
+            "pending": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed_total": counts.get("failed", 0),
+            "oldest_pending_age_s": round(time.time() - oldest, 2) if oldest else None,
+            "queue_latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+        })
+        return stats
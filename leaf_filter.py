@@ -0,0 +1,167 @@
+"""
+Pre-Model Leaf Filter
+Cheap checks on the already-decoded model input (H, W, 3 pixels, 0-255) that
+catch uploads with no usable leaf - black or blown-out frames, flat walls or
+sky, heavy blur, nothing plant-coloured - before the model spends a full
+inference on them only to answer Background_without_leaves.
+
+All scores are computed on a 2x subsample of the model-sized image (80x80
+of the 160x160 input), so the filter costs well under a millisecond and
+allocates only small temporaries. Contrast and blur alone say nothing about
+whether a leaf is present - a flat, evenly lit leaf is both - so those rules
+only reject images that also show little plant colour. The filter is off by
+default; calibrate the thresholds on real uploads with calibrate_leaf_filter.py
+before enabling it.
+"""
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+REJECT_CLASS = "Background_without_leaves"
+
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+DARK_LUMA = 24.0     # pixels darker than this count as black
+BRIGHT_LUMA = 240.0  # pixels brighter than this count as blown-out
+
+# Plant colours: yellow through green hues with some saturation. Excludes the
+# orange/brown hues of soil and wood, and grey/white/black.
+PLANT_HUE_RANGE = (50.0, 170.0)
+PLANT_MIN_SATURATION = 0.15
+
+DEFAULT_MAX_DARK_RATIO = 0.92
+DEFAULT_MAX_BRIGHT_RATIO = 0.92
+DEFAULT_MIN_CONTRAST = 5.0      # luma standard deviation
+DEFAULT_MIN_SHARPNESS = 10.0    # variance of the Laplacian of luma
+DEFAULT_MIN_PLANT_RATIO = 0.02  # share of plant-coloured pixels
+DEFAULT_QUALITY_MAX_PLANT_RATIO = 0.25  # contrast / blur rules only apply below this plant share
+
+REASON_MESSAGES = {
+    "too_dark": "The image is almost entirely dark. Retake the photo in better light.",
+    "overexposed": "The image is almost entirely white. Avoid direct glare or flash on the leaf.",
+    "low_contrast": "The image is nearly uniform and shows no leaf. Frame the affected leaf.",
+    "blurry": "The image is too blurry to analyse. Hold the camera steady and focus on the leaf.",
+    "no_plant": "No leaf or plant tissue was found in the image. Frame the affected leaf.",
+}
+
+
+def leaf_scores(pixels: np.ndarray) -> Dict[str, float]:
+    """Brightness histogram, contrast, sharpness and plant-colour scores for one image (2x subsample)"""
+    rgb = np.asarray(pixels, dtype=np.float32)[::2, ::2]  # strided view, no copy for the pooled input
+    luma = rgb @ LUMA_WEIGHTS  # (H/2, W/2) float32
+
+    center = luma[1:-1, 1:-1]
+    laplacian = 4 * center - luma[:-2, 1:-1] - luma[2:, 1:-1] - luma[1:-1, :-2] - luma[1:-1, 2:]
+
+    # Plant coverage with the hue range tested without computing hue: red-max
+    # pixels need hue >= low (yellow side), green-max pixels need hue <= high
+    # (cyan side), blue-max pixels are never plant
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    high = np.maximum(np.maximum(r, g), b)
+    chroma = high - np.minimum(np.minimum(r, g), b)
+    low_hue, high_hue = PLANT_HUE_RANGE[0] / 60.0, PLANT_HUE_RANGE[1] / 60.0 - 2.0
+    green_max = (g >= r) & (g >= b) & (b - r <= high_hue * chroma)
+    red_max = (r > g) & (r >= b) & (g - b >= low_hue * chroma)
+    plant = (green_max | red_max) & (chroma >= PLANT_MIN_SATURATION * high) & (chroma > 0)
+
+    return {
+        "dark_ratio": round(float(np.count_nonzero(luma < DARK_LUMA)) / luma.size, 4),
+        "bright_ratio": round(float(np.count_nonzero(luma > BRIGHT_LUMA)) / luma.size, 4),
+        "contrast": round(float(luma.std()), 3),
+        "sharpness": round(float(laplacian.var()), 3),
+        "plant_ratio": round(float(np.count_nonzero(plant)) / plant.size, 4),
+    }
+
+
+class LeafFilterResult:
+    """Outcome of one check: passed, the first failed rule (if any) and all scores."""
+
+    def __init__(self, passed: bool, reason: Optional[str], scores: Dict[str, float]):
+        self.passed = passed
+        self.reason = reason
+        self.scores = scores
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "passed": self.passed,
+            "reason": self.reason,
+            "message": REASON_MESSAGES.get(self.reason) if self.reason else None,
+            "scores": self.scores,
+        }
+
+
+class LeafFilter:
+    """
+    Threshold rules over leaf_scores(); the first rule that fails is the rejection reason.
+    low_contrast and blurry only fire when plant_ratio is below quality_max_plant_ratio.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        max_dark_ratio: float = DEFAULT_MAX_DARK_RATIO,
+        max_bright_ratio: float = DEFAULT_MAX_BRIGHT_RATIO,
+        min_contrast: float = DEFAULT_MIN_CONTRAST,
+        min_sharpness: float = DEFAULT_MIN_SHARPNESS,
+        min_plant_ratio: float = DEFAULT_MIN_PLANT_RATIO,
+        quality_max_plant_ratio: float = DEFAULT_QUALITY_MAX_PLANT_RATIO,
+    ):
+        self.enabled = enabled
+        self.max_dark_ratio = max_dark_ratio
+        self.max_bright_ratio = max_bright_ratio
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.min_plant_ratio = min_plant_ratio
+        self.quality_max_plant_ratio = quality_max_plant_ratio
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._rejected: Counter = Counter()
+
+    def rejection_reason(self, scores: Dict[str, float]) -> Optional[str]:
+        if scores["dark_ratio"] > self.max_dark_ratio:
+            return "too_dark"
+        if scores["bright_ratio"] > self.max_bright_ratio:
+            return "overexposed"
+        if scores["plant_ratio"] < self.quality_max_plant_ratio:
+            if scores["contrast"] < self.min_contrast:
+                return "low_contrast"
+            if scores["sharpness"] < self.min_sharpness:
+                return "blurry"
+        if scores["plant_ratio"] < self.min_plant_ratio:
+            return "no_plant"
+        return None
+
+    def check(self, pixels: np.ndarray) -> LeafFilterResult:
+        """Score one (H, W, 3) image; a disabled filter passes everything unscored"""
+        if not self.enabled:
+            return LeafFilterResult(True, None, {})
+        scores = leaf_scores(pixels)
+        reason = self.rejection_reason(scores)
+        with self._lock:
+            self._checked += 1
+            if reason:
+                self._rejected[reason] += 1
+        return LeafFilterResult(reason is None, reason, scores)
+
+    def thresholds(self) -> Dict[str, float]:
+        return {
+            "max_dark_ratio": self.max_dark_ratio,
+            "max_bright_ratio": self.max_bright_ratio,
+            "min_contrast": self.min_contrast,
+            "min_sharpness": self.min_sharpness,
+            "min_plant_ratio": self.min_plant_ratio,
+            "quality_max_plant_ratio": self.quality_max_plant_ratio,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rejected = sum(self._rejected.values())
+            return {
+                "enabled": self.enabled,
+                "checked": self._checked,
+                "rejected": rejected,
+                "rejection_rate": round(rejected / self._checked, 4) if self._checked else None,
+                "by_reason": dict(self._rejected),
+                "thresholds": self.thresholds(),
+            }
@@ -0,0 +1,393 @@
+"""
+Open-Loop Load Generator for the Inference Server
+Sends requests with Poisson arrivals at a target rate - new requests are
+issued on schedule whether or not earlier ones have finished, so queueing
+delay shows up in the numbers instead of silently slowing the generator down.
+Latency is measured from each request's scheduled arrival time.
+
+Usage:
+    # Against a running server, 50 req/s for 30s with a synthetic corpus
+    python load_test.py --url http://localhost:8000 --rate 50 --duration 30
+
+    # In-process against the ASGI app (no network)
+    python load_test.py --asgi inference_server:app --rate 20 --duration 10
+
+    # Find the highest rate that keeps p99 under 500ms
+    python load_test.py --find-max --slo-p99-ms 500 --images ./leaf_photos
+
+Requires httpx (pip install -r requirements-tools.txt).
+"""
+import argparse
+import asyncio
+import importlib
+import io
+import json
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# Synthetic corpus mix: (width, height, share) - phone shots dominate, some huge/small
+SYNTHETIC_SIZES = [
+    ((320, 240), 0.15),
+    ((800, 600), 0.35),
+    ((1600, 1200), 0.30),
+    ((4000, 3000), 0.20),
+]
+
+
+# ============================================================================
+# CORPUS
+# ============================================================================
+def synthetic_leaf(width: int, height: int, rng: random.Random) -> bytes:
+    """A leaf-like JPEG: green blade with veins and lesions on a soil background"""
+    background = tuple(rng.randint(60, 120) for _ in range(3))
+    img = Image.new("RGB", (width, height), background)
+    draw = ImageDraw.Draw(img)
+
+    cx, cy = width / 2, height / 2
+    rx, ry = width * rng.uniform(0.25, 0.45), height * rng.uniform(0.2, 0.4)
+    leaf_color = (rng.randint(30, 90), rng.randint(110, 190), rng.randint(20, 70))
+    draw.ellipse([cx - rx, cy - ry, cx + rx, cy + ry], fill=leaf_color)
+    draw.line([cx - rx, cy, cx + rx, cy], fill=(150, 190, 110), width=max(1, width // 200))
+    for _ in range(rng.randint(0, 25)):  # lesions
+        x, y = rng.uniform(cx - rx * 0.8, cx + rx * 0.8), rng.uniform(cy - ry * 0.7, cy + ry * 0.7)
+        r = rng.uniform(2, max(3, width / 60))
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(rng.randint(90, 140), rng.randint(60, 90), 30))
+
+    noise = np.random.default_rng(rng.randint(0, 2**31)).integers(-12, 12, (height, width, 3))
+    pixels = np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    img = Image.fromarray(pixels).filter(ImageFilter.GaussianBlur(radius=0.8))
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=rng.randint(70, 92))
+    return buffer.getvalue()
+
+
+def build_corpus(image_dir: Optional[Path], synthetic_count: int, seed: int) -> List[Tuple[str, bytes, str]]:
+    """(filename, bytes, content_type) for every corpus image"""
+    if image_dir:
+        corpus = []
+        for path in sorted(p for p in Path(image_dir).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS):
+            content_type = "image/png" if path.suffix.lower() == ".png" else "image/jpeg"
+            corpus.append((path.name, path.read_bytes(), content_type))
+        if not corpus:
+            raise SystemExit(f"No images found in {image_dir}")
+        return corpus
+
+    rng = random.Random(seed)
+    sizes, weights = zip(*SYNTHETIC_SIZES)
+    corpus = []
+    for i in range(synthetic_count):
+        width, height = rng.choices(sizes, weights=weights)[0]
+        corpus.append((f"synthetic_{i}_{width}x{height}.jpg", synthetic_leaf(width, height, rng), "image/jpeg"))
+    return corpus
+
+
+def unique_payload(data: bytes, nonce: str) -> bytes:
+    """
+    Same image, different bytes: the server's result cache keys on the byte hash,
+    so repeated corpus images would otherwise measure the cache, not inference.
+    JPEGs get a COM segment after SOI; other formats get trailing bytes, which
+    decoders ignore.
+    """
+    tag = f"load-test {nonce}".encode("ascii")
+    if data[:2] == b"\xff\xd8":
+        return data[:2] + b"\xff\xfe" + (len(tag) + 2).to_bytes(2, "big") + tag + data[2:]
+    return data + tag
+
+
+# ============================================================================
+# STATISTICS
+# ============================================================================
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 2)
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(latencies_ms)
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": round(values[-1], 2) if values else None,
+    }
+
+
+class RunRecorder:
+    """Per-request outcomes, bucketed by completion second for the time series"""
+
+    def __init__(self, start: float, interval: float):
+        self.start = start
+        self.interval = interval
+        self.latencies_ms: List[float] = []
+        self.outcomes: Counter = Counter()
+        self.buckets: Dict[int, Dict[str, Any]] = {}
+        self.sources: Counter = Counter()
+
+    def record(self, scheduled: float, finished: float, outcome: str, source: Optional[str] = None) -> None:
+        latency_ms = (finished - scheduled) * 1000
+        self.outcomes[outcome] += 1
+        bucket = self.buckets.setdefault(
+            int((finished - self.start) / self.interval), {"ok": 0, "errors": 0, "latencies": []}
+        )
+        if outcome == "ok":
+            self.latencies_ms.append(latency_ms)
+            bucket["ok"] += 1
+            bucket["latencies"].append(latency_ms)
+            if source:
+                self.sources[source] += 1
+        else:
+            bucket["errors"] += 1
+
+    def timeline(self) -> List[Dict[str, Any]]:
+        rows = []
+        for index in sorted(self.buckets):
+            bucket = self.buckets[index]
+            rows.append({
+                "t": round(index * self.interval, 1),
+                "throughput_rps": round(bucket["ok"] / self.interval, 2),
+                "errors": bucket["errors"],
+                **latency_summary(bucket["latencies"]),
+            })
+        return rows
+
+
+# ============================================================================
+# OPEN-LOOP RUN
+# ============================================================================
+async def send_one(client: httpx.AsyncClient, endpoint: str, image: Tuple[str, bytes, str],
+                   scheduled: float, recorder: RunRecorder, timeout: float) -> None:
+    filename, data, content_type = image
+    try:
+        response = await client.post(endpoint, files={"file": (filename, data, content_type)}, timeout=timeout)
+        outcome = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+        source = response.headers.get("X-Prediction-Source") if response.status_code == 200 else None
+    except httpx.TimeoutException:
+        outcome, source = "timeout", None
+    except httpx.HTTPError as e:
+        outcome, source = f"error_{type(e).__name__}", None
+    recorder.record(scheduled, time.perf_counter(), outcome, source)
+
+
+async def run_open_loop(
+    client: httpx.AsyncClient,
+    corpus: List[Tuple[str, bytes, str]],
+    rate: float,
+    duration: float,
+    endpoint: str = "/predict",
+    max_in_flight: int = 1000,
+    timeout: float = 30.0,
+    interval: float = 1.0,
+    seed: int = 0,
+    verbose: bool = True,
+    repeat_images: bool = False,
+) -> Dict[str, Any]:
+    """
+    Poisson arrivals at `rate` req/s for `duration` seconds. Every request's
+    payload is made unique unless `repeat_images` (to measure cache hits).
+    """
+    rng = random.Random(seed)
+    run_id = uuid.uuid4().hex[:12]
+    start = time.perf_counter()
+    recorder = RunRecorder(start, interval)
+    tasks = set()
+    scheduled = start
+    sent = 0
+    shed = 0
+
+    while True:
+        scheduled += rng.expovariate(rate)
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_in_flight:
+            # Generator-side cap so a dead server cannot exhaust local sockets/memory
+            recorder.record(scheduled, time.perf_counter(), "client_shed")
+            shed += 1
+            continue
+        image = rng.choice(corpus)
+        if not repeat_images:
+            filename, data, content_type = image
+            image = (filename, unique_payload(data, f"{run_id}-{sent}"), content_type)
+        task = asyncio.create_task(send_one(client, endpoint, image, scheduled, recorder, timeout))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        sent += 1
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    total = sum(recorder.outcomes.values())
+    ok = recorder.outcomes.get("ok", 0)
+    result = {
+        "target_rate_rps": rate,
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "sent": sent,
+        "client_shed": shed,
+        "throughput_rps": round(ok / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round((total - ok) / total, 4) if total else 0.0,
+        "outcomes": dict(recorder.outcomes),
+        "prediction_sources": dict(recorder.sources),
+        "latency_ms": latency_summary(recorder.latencies_ms),
+        "timeline": recorder.timeline(),
+    }
+    if verbose:
+        print_run(result)
+    return result
+
+
+def print_run(result: Dict[str, Any]) -> None:
+    print("-" * 72)
+    print(f"Target {result['target_rate_rps']:.1f} req/s for {result['duration_s']}s")
+    print(f"{'t(s)':>6} {'ok/s':>8} {'errors':>7} {'p50':>9} {'p90':>9} {'p99':>9}")
+    for row in result["timeline"]:
+        print(f"{row['t']:>6} {row['throughput_rps']:>8} {row['errors']:>7} "
+              f"{row['p50'] or '-':>9} {row['p90'] or '-':>9} {row['p99'] or '-':>9}")
+    lat = result["latency_ms"]
+    print(f"Throughput: {result['throughput_rps']} req/s   Error rate: {result['error_rate']:.2%}   "
+          f"p50={lat['p50']}ms p90={lat['p90']}ms p99={lat['p99']}ms")
+    if result["error_rate"]:
+        print(f"Outcomes: {result['outcomes']}")
+    sources = result["prediction_sources"]
+    print(f"Prediction sources: {sources or '-'}")
+    cached = sources.get("result-cache", 0)
+    if cached:
+        print(f"WARNING: {cached}/{sum(sources.values())} responses came from the result cache - "
+              f"latency and throughput do not reflect model inference")
+
+
+def meets_slo(result: Dict[str, Any], slo_p99_ms: float, max_error_rate: float) -> bool:
+    p99 = result["latency_ms"]["p99"]
+    return p99 is not None and p99 <= slo_p99_ms and result["error_rate"] <= max_error_rate
+
+
+async def find_max_rate(client, corpus, args) -> Dict[str, Any]:
+    """Double the rate until the SLO breaks, then binary-search the boundary"""
+    runs = []
+
+    async def trial(rate: float) -> bool:
+        result = await run_open_loop(client, corpus, rate, args.duration, args.endpoint,
+                                     args.max_in_flight, args.timeout, seed=args.seed,
+                                     repeat_images=args.repeat_images)
+        ok = meets_slo(result, args.slo_p99_ms, args.max_error_rate)
+        print(f"==> {rate:.1f} req/s: {'MEETS' if ok else 'VIOLATES'} SLO "
+              f"(p99={result['latency_ms']['p99']}ms, errors={result['error_rate']:.2%})")
+        runs.append({**result, "meets_slo": ok})
+        return ok
+
+    good, bad = 0.0, None
+    rate = args.rate
+    while rate <= args.max_rate:
+        if await trial(rate):
+            good, rate = rate, rate * 2
+        else:
+            bad = rate
+            break
+    if bad is not None:
+        for _ in range(args.search_steps):
+            mid = (good + bad) / 2
+            if bad - good <= max(0.5, good * 0.05):
+                break
+            if await trial(mid):
+                good = mid
+            else:
+                bad = mid
+
+    return {
+        "slo_p99_ms": args.slo_p99_ms,
+        "max_error_rate": args.max_error_rate,
+        "max_sustainable_rps": round(good, 2) if good else None,
+        "first_failing_rps": round(bad, 2) if bad else None,
+        "runs": runs,
+    }
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+def load_asgi_app(spec: str):
+    module_name, _, attr = spec.partition(":")
+    sys.path.insert(0, str(Path.cwd()))
+    return getattr(importlib.import_module(module_name), attr or "app")
+
+
+async def main(args) -> Dict[str, Any]:
+    corpus = build_corpus(args.images, args.synthetic_count, args.seed)
+    sizes = [len(data) for _, data, _ in corpus]
+    print(f"Corpus: {len(corpus)} images, {min(sizes) / 1024:.0f}-{max(sizes) / 1024:.0f} KB")
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    if args.asgi:
+        app = load_asgi_app(args.asgi)
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://inprocess"
+        print(f"Target: in-process ASGI app {args.asgi}")
+    else:
+        app, transport, base_url = None, None, args.url
+        print(f"Target: {args.url} ({args.connections} connections)")
+
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits) as client:
+        if app is not None and hasattr(app, "router"):
+            # Run startup/shutdown handlers (history writer, job workers) like a real server
+            async with app.router.lifespan_context(app):
+                return await _dispatch(client, corpus, args)
+        return await _dispatch(client, corpus, args)
+
+
+async def _dispatch(client, corpus, args) -> Dict[str, Any]:
+    if args.find_max:
+        report = await find_max_rate(client, corpus, args)
+        print("=" * 72)
+        print(f"Max sustainable rate under p99 <= {args.slo_p99_ms}ms: "
+              f"{report['max_sustainable_rps']} req/s")
+        return report
+    return await run_open_loop(client, corpus, args.rate, args.duration, args.endpoint,
+                               args.max_in_flight, args.timeout, seed=args.seed,
+                               repeat_images=args.repeat_images)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-loop load test for the crop disease API")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8000", help="Server base URL")
+    target.add_argument("--asgi", help="Run in-process against an ASGI app, e.g. inference_server:app")
+    parser.add_argument("--endpoint", default="/predict")
+    parser.add_argument("--rate", type=float, default=10.0, help="Target arrival rate (req/s)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per run")
+    parser.add_argument("--connections", type=int, default=100, help="Max concurrent connections")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Shed arrivals beyond this many outstanding")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout (s)")
+    parser.add_argument("--images", type=Path, help="Directory of real leaf images (default: synthetic corpus)")
+    parser.add_argument("--synthetic-count", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat-images", action="store_true",
+                        help="Send corpus bytes unchanged (repeats hit the server's result cache)")
+    parser.add_argument("--find-max", action="store_true", help="Search for the max rate meeting the SLO")
+    parser.add_argument("--slo-p99-ms", type=float, default=1000.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--max-rate", type=float, default=2000.0)
+    parser.add_argument("--search-steps", type=int, default=6)
+    parser.add_argument("--report", type=Path, help="Write the full JSON report here")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.report:
+        args.report.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.report}")
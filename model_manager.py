@@ -0,0 +1,320 @@
+"""
+Multi-Model Serving
+Serves several Keras models (e.g. crop- or region-specific) next to the
+general 39-class model. Each model has its own class list, is loaded on first
+use and is evicted least-recently-used when the configured RAM budget is
+exceeded. Concurrent requests for a model that is still loading wait for the
+single in-progress load instead of loading it again.
+
+Registry file (models.json):
+    {
+      "models": [
+        {
+          "name": "tomato",
+          "path": "models/tomato_disease.keras",
+          "metadata": "models/tomato_disease.classes.json",
+          "routes": ["tomato", "tomato-maharashtra"],
+          "description": "Tomato-specific disease model"
+        }
+      ]
+    }
+
+Metadata file (class list, optional input size):
+    {"class_names": ["Tomato___Bacterial_spot", ...], "input_size": [160, 160]}
+"""
+import gc
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotFoundError(KeyError):
+    """No model is registered under the requested name or route"""
+
+
+class ModelRegistrationError(ValueError):
+    """A model's name or one of its routes is already taken by another model"""
+
+
+class ModelSpec:
+    """Registry entry for one servable model."""
+
+    def __init__(
+        self,
+        name: str,
+        path: Path,
+        metadata_path: Optional[Path] = None,
+        class_names: Optional[Sequence[str]] = None,
+        routes: Sequence[str] = (),
+        description: str = "",
+        pinned: bool = False,
+    ):
+        self.name = name
+        self.path = Path(path)
+        self.metadata_path = Path(metadata_path) if metadata_path else None
+        self.class_names = list(class_names) if class_names else None
+        self.routes = list(routes)
+        self.description = description
+        self.pinned = pinned  # pinned models are never evicted
+
+    def read_metadata(self) -> Tuple[List[str], Optional[Tuple[int, int]]]:
+        """Class list and optional input size from the metadata file"""
+        if self.class_names is not None and self.metadata_path is None:
+            return self.class_names, None
+        metadata_path = self.metadata_path or self.path.with_suffix(".classes.json")
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        class_names = metadata.get("class_names")
+        if not class_names:
+            raise ValueError(f"{metadata_path} has no 'class_names' list")
+        input_size = tuple(metadata["input_size"]) if metadata.get("input_size") else None
+        return list(class_names), input_size
+
+
+class LoadedModel:
+    """A model in memory together with everything needed to serve it."""
+
+    def __init__(self, spec: ModelSpec, model: Any, class_names: List[str],
+                 input_size: Tuple[int, int], version: str, memory_bytes: int, load_time: float):
+        self.spec = spec
+        self.model = model
+        self.class_names = class_names
+        self.input_size = input_size
+        self.version = version
+        self.memory_bytes = memory_bytes
+        self.load_time = load_time
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+
+def estimate_model_memory(model: Any, path: Path) -> int:
+    """Bytes a loaded model is expected to occupy (float32 weights, or file size)"""
+    try:
+        return int(model.count_params()) * 4
+    except Exception:
+        return path.stat().st_size
+
+
+def file_version(path: Path) -> str:
+    """Content-hash version string, same scheme as inference_server.MODEL_VERSION"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return f"{path.stem}@{digest.hexdigest()[:12]}"
+
+
+class ModelManager:
+    """LRU cache of models bounded by an estimated RAM budget."""
+
+    def __init__(
+        self,
+        loader: Callable[[Path], Any],
+        memory_budget_bytes: int,
+        default_input_size: Tuple[int, int] = (160, 160),
+    ):
+        self.loader = loader
+        self.memory_budget_bytes = memory_budget_bytes
+        self.default_input_size = default_input_size
+
+        self._specs: Dict[str, ModelSpec] = {}
+        self._routes: Dict[str, str] = {}
+        self._loaded: "OrderedDict[str, LoadedModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    # ------------------------------------------------------------------------
+    # Registration
+    # ------------------------------------------------------------------------
+    def register(self, spec: ModelSpec, preloaded: Optional[LoadedModel] = None) -> None:
+        """Add a model; raises ModelRegistrationError if its name or any route is already taken"""
+        routes = list(dict.fromkeys(route.lower() for route in [spec.name] + spec.routes))
+        with self._lock:
+            if spec.name in self._specs:
+                raise ModelRegistrationError(f"Model '{spec.name}' is already registered")
+            taken = [f"'{route}' (model '{self._routes[route]}')" for route in routes if route in self._routes]
+            if taken:
+                raise ModelRegistrationError(
+                    f"Model '{spec.name}' uses name/route(s) already taken: {', '.join(taken)}"
+                )
+            self._specs[spec.name] = spec
+            for route in routes:
+                self._routes[route] = spec.name
+            self._load_locks.setdefault(spec.name, threading.Lock())
+            self._stats.setdefault(spec.name, {
+                "requests": 0, "loads": 0, "evictions": 0,
+                "total_latency_ms": 0.0, "recent_latency_ms": deque(maxlen=500),
+            })
+            if preloaded is not None:
+                self._loaded[spec.name] = preloaded
+                self._stats[spec.name]["loads"] += 1
+        logger.info(f"Registered model '{spec.name}' (routes: {', '.join(spec.routes) or '-'})")
+
+    def load_registry(self, registry_path: Path) -> int:
+        """
+        Register every model listed in a registry JSON file; returns how many.
+        Entries whose name or routes collide with a registered model are
+        skipped with an error - they never replace an existing model.
+        """
+        registry_path = Path(registry_path)
+        with open(registry_path, "r", encoding="utf-8") as f:
+            registry = json.load(f)
+        base_dir = registry_path.parent
+        count = 0
+        for entry in registry.get("models", []):
+            path = base_dir / entry["path"]
+            metadata = base_dir / entry["metadata"] if entry.get("metadata") else None
+            try:
+                self.register(ModelSpec(
+                    name=entry["name"],
+                    path=path,
+                    metadata_path=metadata,
+                    routes=entry.get("routes", []),
+                    description=entry.get("description", ""),
+                    pinned=entry.get("pinned", False),
+                ))
+            except ModelRegistrationError as e:
+                logger.error(f"❌ Skipping registry entry in {registry_path.name}: {e}")
+                continue
+            count += 1
+        return count
+
+    def resolve(self, name_or_route: str) -> str:
+        with self._lock:
+            name = self._routes.get(name_or_route.lower())
+        if name is None:
+            raise ModelNotFoundError(name_or_route)
+        return name
+
+    # ------------------------------------------------------------------------
+    # Loading / eviction
+    # ------------------------------------------------------------------------
+    def get(self, name_or_route: str) -> LoadedModel:
+        """Return a loaded model, loading it (once) if needed. Blocking."""
+        name = self.resolve(name_or_route)
+        with self._lock:
+            loaded = self._loaded.get(name)
+            if loaded is not None:
+                self._loaded.move_to_end(name)
+                return loaded
+            load_lock = self._load_locks[name]
+
+        # Single-flight: only one thread loads a given model; others wait here
+        with load_lock:
+            with self._lock:
+                loaded = self._loaded.get(name)
+                if loaded is not None:
+                    self._loaded.move_to_end(name)
+                    return loaded
+                spec = self._specs[name]
+            loaded = self._load(spec)
+            with self._lock:
+                self._loaded[name] = loaded
+                self._stats[name]["loads"] += 1
+                self._evict_over_budget(keep=name)
+            return loaded
+
+    def _load(self, spec: ModelSpec) -> LoadedModel:
+        logger.info(f"Loading model '{spec.name}' from {spec.path}...")
+        start = time.time()
+        if not spec.path.exists():
+            raise FileNotFoundError(f"Model file not found: {spec.path}")
+        class_names, input_size = spec.read_metadata()
+        model = self.loader(spec.path)
+
+        num_classes = model.output_shape[-1] if getattr(model, "output_shape", None) else None
+        if num_classes and num_classes != len(class_names):
+            raise ValueError(
+                f"Model '{spec.name}' outputs {num_classes} classes but metadata lists {len(class_names)}"
+            )
+        if input_size is None:
+            shape = getattr(model, "input_shape", None)
+            input_size = (shape[2], shape[1]) if shape and shape[1] and shape[2] else self.default_input_size
+
+        loaded = LoadedModel(
+            spec=spec,
+            model=model,
+            class_names=class_names,
+            input_size=tuple(input_size),
+            version=file_version(spec.path),
+            memory_bytes=estimate_model_memory(model, spec.path),
+            load_time=time.time() - start,
+        )
+        logger.info(
+            f"✅ Loaded model '{spec.name}' in {loaded.load_time:.2f}s "
+            f"({len(class_names)} classes, ~{loaded.memory_bytes / (1024 * 1024):.1f} MB)"
+        )
+        return loaded
+
+    def _evict_over_budget(self, keep: str) -> None:
+        """Drop least-recently-used unpinned models until within budget (lock held)"""
+        evicted = False
+        for name in list(self._loaded.keys()):
+            if self._used_bytes() <= self.memory_budget_bytes:
+                break
+            loaded = self._loaded[name]
+            if name == keep or loaded.spec.pinned:
+                continue
+            del self._loaded[name]
+            self._stats[name]["evictions"] += 1
+            evicted = True
+            logger.info(f"Evicted model '{name}' (~{loaded.memory_bytes / (1024 * 1024):.1f} MB) - RAM budget")
+        if evicted:
+            gc.collect()
+        if self._used_bytes() > self.memory_budget_bytes:
+            logger.warning("⚠️ Loaded models exceed the RAM budget even after eviction (pinned/in-use models)")
+
+    def _used_bytes(self) -> int:
+        return sum(loaded.memory_bytes for loaded in self._loaded.values())
+
+    # ------------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------------
+    def record_request(self, name: str, latency_ms: float) -> None:
+        with self._lock:
+            stats = self._stats[name]
+            stats["requests"] += 1
+            stats["total_latency_ms"] += latency_ms
+            stats["recent_latency_ms"].append(latency_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for name, spec in self._specs.items():
+                stats = self._stats[name]
+                loaded = self._loaded.get(name)
+                recent = sorted(stats["recent_latency_ms"])
+                models[name] = {
+                    "routes": spec.routes,
+                    "description": spec.description,
+                    "pinned": spec.pinned,
+                    "loaded": loaded is not None,
+                    "version": loaded.version if loaded else None,
+                    "num_classes": len(loaded.class_names) if loaded else None,
+                    "memory_mb": round(loaded.memory_bytes / (1024 * 1024), 1) if loaded else 0.0,
+                    "requests": stats["requests"],
+                    "loads": stats["loads"],
+                    "evictions": stats["evictions"],
+                    "avg_latency_ms": (
+                        round(stats["total_latency_ms"] / stats["requests"], 2) if stats["requests"] else None
+                    ),
+                    "p95_latency_ms": (
+                        round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 2) if recent else None
+                    ),
+                }
+            return {
+                "memory_budget_mb": round(self.memory_budget_bytes / (1024 * 1024), 1),
+                "memory_used_mb": round(self._used_bytes() / (1024 * 1024), 1),
+                "lru_order": list(self._loaded.keys()),
+                "models": models,
+            }
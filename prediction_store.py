@@ -0,0 +1,327 @@
+"""
+Prediction History Store
+Persists every prediction from inference_server.py into a local SQLite database.
+
+Writes never happen on the request path: record() only enqueues the row and a
+background writer thread drains the queue in batched transactions (WAL mode),
+so a burst of requests costs one fsync per batch instead of one per request.
+"""
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  created_at REAL NOT NULL,
+  request_id TEXT,
+  image_hash TEXT NOT NULL,
+  class_name TEXT NOT NULL,
+  confidence REAL NOT NULL,
+  top_k TEXT NOT NULL,
+  model_version TEXT NOT NULL,
+  latency_ms REAL,
+  user_id TEXT,
+  plot_id TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_predictions_user ON predictions(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_plot ON predictions(plot_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_predictions_time_class ON predictions(created_at, class_name);
+"""
+
+INSERT_SQL = """
+INSERT INTO predictions (
+  created_at, request_id, image_hash, class_name, confidence,
+  top_k, model_version, latency_ms, user_id, plot_id
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class PredictionStore:
+    """
+    SQLite-backed prediction history with a write-behind queue.
+
+    - record() is non-blocking; if the queue is full the row is dropped and
+      counted rather than stalling inference.
+    - The writer commits up to `batch_size` rows per transaction, or whatever
+      has arrived after `flush_interval` seconds.
+    - Reads use their own short-lived connections, which WAL lets run
+      concurrently with the writer.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        max_queue_size: int = 10000,
+    ):
+        self.db_path = Path(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "batches": 0,
+            "write_errors": 0,
+            "last_batch_size": 0,
+            "last_batch_ms": 0.0,
+        }
+        self._init_db()
+
+    # ------------------------------------------------------------------------
+    # Setup / lifecycle
+    # ------------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.db_path), timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self) -> None:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """Start the background writer thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._writer_loop, name="prediction-store-writer", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"✅ Prediction store writer started: {self.db_path}")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Flush everything still queued and stop the writer thread."""
+        if not self._thread:
+            return
+        self._queue.put(None)  # sentinel - blocks only if the queue is full
+        self._thread.join(timeout=timeout)
+        self._thread = None
+        logger.info("Prediction store writer stopped")
+
+    # ------------------------------------------------------------------------
+    # Write path
+    # ------------------------------------------------------------------------
+    def record(
+        self,
+        image_hash: str,
+        class_name: str,
+        confidence: float,
+        top_k: List[Dict[str, Any]],
+        model_version: str,
+        latency_ms: Optional[float] = None,
+        user_id: Optional[str] = None,
+        plot_id: Optional[str] = None,
+        request_id: Optional[str] = None,
+        created_at: Optional[float] = None,
+    ) -> bool:
+        """Queue a prediction for persistence. Returns False if it was dropped."""
+        row = (
+            created_at if created_at is not None else time.time(),
+            request_id,
+            image_hash,
+            class_name,
+            float(confidence),
+            json.dumps(top_k),
+            model_version,
+            latency_ms,
+            user_id,
+            plot_id,
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["dropped"] += 1
+            logger.warning("⚠️ Prediction store queue full - dropping history row")
+            return False
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def _writer_loop(self) -> None:
+        conn = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                try:
+                    first = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                if first is None:
+                    stopping = True
+                    batch = []
+                else:
+                    batch = [first]
+                # Drain whatever else is already waiting, up to batch_size
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                if batch:
+                    self._write_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        start = time.time()
+        try:
+            with conn:
+                conn.executemany(INSERT_SQL, batch)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Prediction store write failed ({len(batch)} rows): {e}")
+            with self._stats_lock:
+                self._stats["write_errors"] += 1
+                self._stats["dropped"] += len(batch)
+            return
+        elapsed_ms = (time.time() - start) * 1000
+        with self._stats_lock:
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_batch_ms"] = round(elapsed_ms, 2)
+
+    # ------------------------------------------------------------------------
+    # Read path
+    # ------------------------------------------------------------------------
+    def history(
+        self,
+        user_id: Optional[str] = None,
+        plot_id: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """Most recent predictions for a user and/or plot, newest first."""
+        clauses, params = self._filters(user_id, plot_id, since, until)
+        sql = (
+            "SELECT id, created_at, request_id, image_hash, class_name, confidence, "
+            "top_k, model_version, latency_ms, user_id, plot_id FROM predictions"
+        )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(int(limit))
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        results = []
+        for row in rows:
+            item = dict(row)
+            item["top_k"] = json.loads(item["top_k"])
+            results.append(item)
+        return results
+
+    def disease_counts(
+        self,
+        since: float,
+        until: Optional[float] = None,
+        user_id: Optional[str] = None,
+        plot_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Number of predictions per class inside a time window, most frequent first."""
+        clauses, params = self._filters(user_id, plot_id, since, until)
+        sql = "SELECT class_name, COUNT(*) AS count FROM predictions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " GROUP BY class_name ORDER BY count DESC"
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def _filters(user_id, plot_id, since, until):
+        clauses, params = [], []
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if plot_id is not None:
+            clauses.append("plot_id = ?")
+            params.append(plot_id)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        return clauses, params
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["writer_running"] = bool(self._thread and self._thread.is_alive())
+        stats["db_path"] = str(self.db_path)
+        return stats
+
+
+# ============================================================================
+# THROUGHPUT CHECK
+# ============================================================================
+if __name__ == "__main__":
+    # Quick check that the write-behind path keeps up with peak request rates:
+    #   python prediction_store.py [num_rows]
+    import sys
+    import tempfile
+
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PredictionStore(Path(tmp) / "bench.db", max_queue_size=num_rows + 1)
+        store.start()
+        top_k = [{"class": "Tomato___Late_blight", "confidence": 0.9}]
+
+        start = time.time()
+        for i in range(num_rows):
+            store.record(
+                image_hash=f"{i:064x}",
+                class_name="Tomato___Late_blight",
+                confidence=0.9,
+                top_k=top_k,
+                model_version="bench",
+                latency_ms=12.5,
+                user_id=str(i % 100),
+                plot_id=str(i % 1000),
+            )
+        enqueue_time = time.time() - start
+        store.stop(timeout=120)
+        total_time = time.time() - start
+
+        stats = store.stats()
+        print(f"Rows:           {num_rows}")
+        print(f"Enqueue rate:   {num_rows / enqueue_time:,.0f} rows/s (request-path cost)")
+        print(f"Persist rate:   {stats['written'] / total_time:,.0f} rows/s")
+        print(f"Batches:        {stats['batches']} (avg {stats['written'] / max(stats['batches'], 1):.0f} rows)")
+        print(f"Dropped:        {stats['dropped']}")
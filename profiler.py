@@ -0,0 +1,290 @@
+"""
+On-Demand Profiling for the Live Server
+Captures a time-boxed profile of the running process without a restart:
+
+- a Python sampling profile of every thread (sys._current_frames), written
+  as collapsed stacks (flamegraph.pl / speedscope compatible), and
+- optionally a TensorFlow profiler trace of model execution (TensorBoard
+  profile plugin format), summarized by op where the XPlane protos are available.
+
+Hard limits keep profiling from taking the service down: a maximum duration,
+one capture at a time, a cooldown between captures, a sampling-interval floor,
+bounded stack depth and a cap on retained output files.
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL_SECONDS = 0.001
+MAX_STACK_DEPTH = 64
+
+# Leaf frames that mean "this thread is waiting, not working"
+IDLE_FUNCTIONS = {
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"), ("queue.py", "get"), ("socket.py", "accept"),
+    ("base_events.py", "_run_once"), ("thread.py", "_worker"),
+}
+
+CATEGORIES = (
+    ("PIL", ("/PIL/",)),
+    ("numpy", ("/numpy/",)),
+    ("tensorflow", ("/tensorflow/", "/keras/", "/tf_keras/")),
+    ("logging", ("/logging/",)),
+    ("sqlite", ("/sqlite3/", "prediction_store.py", "job_queue.py")),
+    ("http", ("/starlette/", "/fastapi/", "/uvicorn/", "/h11/", "/httptools/", "/multipart/")),
+)
+
+Frame = Tuple[str, str, int]  # (filename, function, first line)
+
+
+class ProfilerBusyError(RuntimeError):
+    """Another capture is already running"""
+
+
+class ProfilerCooldownError(RuntimeError):
+    """Captures are rate-limited; retry_after is in seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Profiler cooling down, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def frame_label(frame: Frame) -> str:
+    filename, function, line = frame
+    return f"{function} ({os.path.basename(filename)}:{line})"
+
+
+def categorize(filename: str) -> str:
+    normalized = filename.replace("\\", "/")
+    for name, markers in CATEGORIES:
+        if any(marker in normalized for marker in markers):
+            return name
+    return "other"
+
+
+def sample_stacks(duration: float, interval: float) -> Tuple[Counter, int]:
+    """
+    Sample the stacks of every other thread for `duration` seconds.
+    Returns (Counter of root-first stack tuples, number of sampling rounds).
+    """
+    own_ident = threading.get_ident()
+    stacks: Counter = Counter()
+    rounds = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                frame = frame.f_back
+            stacks[tuple(reversed(stack))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def summarize_stacks(stacks: Counter, top_n: int) -> Dict[str, Any]:
+    """Top functions by self / cumulative samples and time split by library"""
+    self_counts: Counter = Counter()
+    cumulative_counts: Counter = Counter()
+    category_counts: Counter = Counter()
+    idle_samples = 0
+
+    for stack, count in stacks.items():
+        if not stack:
+            continue
+        leaf = stack[-1]
+        if (os.path.basename(leaf[0]), leaf[1]) in IDLE_FUNCTIONS:
+            idle_samples += count
+            continue
+        self_counts[leaf] += count
+        category_counts[categorize(leaf[0])] += count
+        for frame in set(stack):
+            cumulative_counts[frame] += count
+
+    active = sum(self_counts.values())
+
+    def top(counter: Counter) -> List[Dict[str, Any]]:
+        return [
+            {"function": frame_label(frame), "samples": n, "percent": round(100.0 * n / active, 2)}
+            for frame, n in counter.most_common(top_n)
+        ]
+
+    return {
+        "active_samples": active,
+        "idle_samples": idle_samples,
+        "by_category": {
+            name: {"samples": n, "percent": round(100.0 * n / active, 2)}
+            for name, n in category_counts.most_common()
+        } if active else {},
+        "top_self": top(self_counts) if active else [],
+        "top_cumulative": top(cumulative_counts) if active else [],
+    }
+
+
+def write_collapsed(stacks: Counter, path: Path) -> None:
+    """One 'root;caller;leaf count' line per unique stack"""
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(";".join(frame_label(frame) for frame in stack) + f" {count}\n")
+
+
+def summarize_tf_trace(logdir: Path, top_n: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Aggregate op durations from the XPlane files the TF profiler wrote.
+    Returns None if the XPlane protos cannot be imported in this TF build.
+    """
+    try:
+        from tsl.profiler.protobuf import xplane_pb2
+    except ImportError:
+        try:
+            from tensorflow.tsl.profiler.protobuf import xplane_pb2
+        except ImportError:
+            return None
+
+    durations: Counter = Counter()
+    occurrences: Counter = Counter()
+    for xplane_file in logdir.rglob("*.xplane.pb"):
+        space = xplane_pb2.XSpace()
+        space.ParseFromString(xplane_file.read_bytes())
+        for plane in space.planes:
+            names = {key: meta.name for key, meta in plane.event_metadata.items()}
+            for line in plane.lines:
+                # Host-side TF op lines and device op lines; skip Python tracer noise
+                if "python" in line.name.lower():
+                    continue
+                for event in line.events:
+                    name = names.get(event.metadata_id, "")
+                    if name:
+                        durations[name] += event.duration_ps
+                        occurrences[name] += 1
+
+    total = sum(durations.values()) or 1
+    return [
+        {
+            "op": name,
+            "total_ms": round(ps / 1e9, 3),
+            "count": occurrences[name],
+            "percent": round(100.0 * ps / total, 2),
+        }
+        for name, ps in durations.most_common(top_n)
+    ]
+
+
+class ProfilerService:
+    """Runs at most one bounded capture at a time and keeps its output on disk."""
+
+    def __init__(
+        self,
+        output_dir: Path,
+        max_seconds: float = 30.0,
+        cooldown_seconds: float = 60.0,
+        default_interval: float = 0.01,
+        max_files: int = 20,
+    ):
+        self.output_dir = Path(output_dir)
+        self.max_seconds = max_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.default_interval = default_interval
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._last_finished = 0.0
+
+    def capture(
+        self,
+        seconds: float,
+        python: bool = True,
+        tensorflow: bool = False,
+        interval: Optional[float] = None,
+        top_n: int = 25,
+    ) -> Dict[str, Any]:
+        """Blocking capture; call from a worker thread, never the event loop"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile capture is already running")
+        try:
+            wait = self.cooldown_seconds - (time.time() - self._last_finished)
+            if wait > 0:
+                raise ProfilerCooldownError(wait)
+            return self._capture(seconds, python, tensorflow, interval, top_n)
+        finally:
+            self._lock.release()
+
+    def _capture(self, seconds, python, tensorflow, interval, top_n) -> Dict[str, Any]:
+        seconds = min(max(float(seconds), 0.5), self.max_seconds)
+        interval = max(interval or self.default_interval, MIN_INTERVAL_SECONDS)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        result: Dict[str, Any] = {"started_at": time.time(), "duration_s": seconds, "interval_s": interval}
+
+        tf_logdir = None
+        if tensorflow:
+            import tensorflow as tf
+            tf_logdir = self.output_dir / f"tf_trace_{stamp}"
+            tf.profiler.experimental.start(str(tf_logdir))
+        logger.warning(f"⚠️ Profiling live server for {seconds:.1f}s (python={python}, tensorflow={tensorflow})")
+
+        try:
+            if python:
+                stacks, rounds = sample_stacks(seconds, interval)
+            else:
+                time.sleep(seconds)
+        finally:
+            if tensorflow:
+                tf.profiler.experimental.stop()
+            self._last_finished = time.time()
+
+        if python:
+            collapsed_path = self.output_dir / f"profile_{stamp}.collapsed.txt"
+            write_collapsed(stacks, collapsed_path)
+            result["python"] = {
+                "sampling_rounds": rounds,
+                "collapsed_stacks_file": str(collapsed_path),
+                **summarize_stacks(stacks, top_n),
+            }
+
+        if tf_logdir is not None:
+            ops = summarize_tf_trace(tf_logdir, top_n)
+            result["tensorflow"] = {
+                "trace_dir": str(tf_logdir),
+                "top_ops": ops,
+                "note": None if ops is not None else
+                "XPlane protos unavailable in this TF build - open trace_dir in TensorBoard's Profile tab",
+            }
+
+        summary_path = self.output_dir / f"profile_{stamp}.json"
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        result["summary_file"] = str(summary_path)
+        self._prune()
+        logger.info(f"✅ Profile written to {summary_path}")
+        return result
+
+    def _prune(self) -> None:
+        """Keep only the newest max_files captures (summary + stacks + trace dirs)"""
+        entries = sorted(self.output_dir.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in entries[self.max_files * 3:]:
+            if old.is_dir():
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                old.unlink(missing_ok=True)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "busy": self._lock.locked(),
+            "last_finished": self._last_finished or None,
+            "max_seconds": self.max_seconds,
+            "cooldown_seconds": self.cooldown_seconds,
+            "output_dir": str(self.output_dir),
+        }
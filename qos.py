@@ -0,0 +1,199 @@
+"""
+Adaptive Quality-of-Service Controller
+Watches prediction queue depth (requests in flight) and recent latency and
+steps the server down to cheaper service tiers under overload, then back up
+once load drops.
+
+Escalation is immediate; recovery happens one tier at a time, only after
+load has stayed well below the tier's thresholds for `min_dwell_seconds`,
+so the server does not flap between tiers.
+
+Only single-image requests feed the latency signal (batch-style requests
+count toward queue depth only), and the latency EWMA decays with elapsed
+time, so an idle server does not stay degraded on a stale overload reading.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceTier:
+    """One level of prediction cost/quality."""
+
+    def __init__(
+        self,
+        name: str,
+        resample: Image.Resampling,
+        batch_multiplier: int = 1,
+        draft_decode: bool = False,
+        use_quantized: bool = False,
+    ):
+        self.name = name
+        self.resample = resample
+        self.batch_multiplier = batch_multiplier
+        # JPEG draft mode decodes at a reduced DCT scale - much cheaper for big photos
+        self.draft_decode = draft_decode
+        self.use_quantized = use_quantized
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "resample": self.resample.name,
+            "batch_multiplier": self.batch_multiplier,
+            "draft_decode": self.draft_decode,
+            "use_quantized": self.use_quantized,
+        }
+
+
+DEFAULT_TIERS = [
+    ServiceTier("full", Image.Resampling.LANCZOS),
+    ServiceTier("reduced", Image.Resampling.BILINEAR, batch_multiplier=2, draft_decode=True),
+    ServiceTier("economy", Image.Resampling.NEAREST, batch_multiplier=4, draft_decode=True, use_quantized=True),
+]
+
+
+class AdaptiveQoSController:
+    """
+    Picks the active ServiceTier from queue depth and an EWMA of latency.
+
+    `queue_depth_thresholds[i]` / `latency_thresholds_ms[i]` is the load at
+    which tier i+1 is entered; either signal alone is enough to degrade.
+    """
+
+    def __init__(
+        self,
+        tiers: Sequence[ServiceTier] = DEFAULT_TIERS,
+        queue_depth_thresholds: Sequence[int] = (8, 32),
+        latency_thresholds_ms: Sequence[float] = (800.0, 2000.0),
+        recover_ratio: float = 0.5,
+        min_dwell_seconds: float = 5.0,
+        ewma_alpha: float = 0.2,
+        latency_half_life_seconds: float = 10.0,
+        enabled: bool = True,
+    ):
+        if len(queue_depth_thresholds) != len(tiers) - 1 or len(latency_thresholds_ms) != len(tiers) - 1:
+            raise ValueError("Need one queue-depth and one latency threshold per degraded tier")
+        self.tiers: List[ServiceTier] = list(tiers)
+        self.queue_depth_thresholds = list(queue_depth_thresholds)
+        self.latency_thresholds_ms = list(latency_thresholds_ms)
+        self.recover_ratio = recover_ratio
+        self.min_dwell_seconds = min_dwell_seconds
+        self.ewma_alpha = ewma_alpha
+        self.latency_half_life_seconds = latency_half_life_seconds
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._level = 0
+        self._in_flight = 0
+        self._latency_ewma_ms: Optional[float] = None
+        self._latency_updated = time.monotonic()
+        self._level_since = time.monotonic()
+        self._transitions = 0
+        self._requests_per_tier = {tier.name: 0 for tier in self.tiers}
+        self._seconds_per_tier = {tier.name: 0.0 for tier in self.tiers}
+
+    # ------------------------------------------------------------------------
+    # Request tracking
+    # ------------------------------------------------------------------------
+    def request_started(self) -> ServiceTier:
+        """Register a request entering the queue; returns the tier it should use."""
+        with self._lock:
+            self._in_flight += 1
+            self._evaluate()
+            tier = self.tiers[self._level]
+            self._requests_per_tier[tier.name] += 1
+            return tier
+
+    def request_finished(self, latency_ms: Optional[float] = None) -> None:
+        """
+        Register a request leaving the queue. latency_ms feeds the EWMA; pass
+        None for requests whose duration is not comparable to a single-image
+        prediction (tiled images, raw batches) - they only count toward depth.
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if latency_ms is not None:
+                now = time.monotonic()
+                self._decay_latency(now)
+                if self._latency_ewma_ms is None:
+                    self._latency_ewma_ms = latency_ms
+                else:
+                    self._latency_ewma_ms += self.ewma_alpha * (latency_ms - self._latency_ewma_ms)
+            self._evaluate()
+
+    def current_tier(self) -> ServiceTier:
+        with self._lock:
+            self._evaluate()
+            return self.tiers[self._level]
+
+    # ------------------------------------------------------------------------
+    # Tier selection (caller holds the lock)
+    # ------------------------------------------------------------------------
+    def _decay_latency(self, now: float) -> None:
+        """Halve the EWMA every latency_half_life_seconds without a new sample"""
+        if self._latency_ewma_ms is not None and self.latency_half_life_seconds > 0:
+            elapsed = now - self._latency_updated
+            self._latency_ewma_ms *= 0.5 ** (elapsed / self.latency_half_life_seconds)
+        self._latency_updated = now
+
+    def _overload_level(self, scale: float = 1.0) -> int:
+        depth = self._in_flight
+        latency = self._latency_ewma_ms or 0.0
+        level = 0
+        for i, (depth_thr, latency_thr) in enumerate(zip(self.queue_depth_thresholds, self.latency_thresholds_ms)):
+            if depth >= depth_thr * scale or latency >= latency_thr * scale:
+                level = i + 1
+        return level
+
+    def _evaluate(self) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._decay_latency(now)
+        target = self._overload_level()
+        if target > self._level:
+            self._set_level(target, now)
+        elif target < self._level and now - self._level_since >= self.min_dwell_seconds:
+            # Only recover once load is comfortably below the current tier's entry point
+            if self._overload_level(scale=self.recover_ratio) < self._level:
+                self._set_level(self._level - 1, now)
+
+    def _set_level(self, level: int, now: float) -> None:
+        old = self.tiers[self._level]
+        self._seconds_per_tier[old.name] += now - self._level_since
+        self._level = level
+        self._level_since = now
+        self._transitions += 1
+        new = self.tiers[level]
+        log = logger.warning if level > 0 else logger.info
+        log(
+            f"{'⚠️' if level > 0 else '✅'} QoS tier {old.name} -> {new.name} "
+            f"(in_flight={self._in_flight}, latency_ewma={self._latency_ewma_ms or 0:.0f}ms)"
+        )
+
+    # ------------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._evaluate()
+            now = time.monotonic()
+            seconds = dict(self._seconds_per_tier)
+            seconds[self.tiers[self._level].name] += now - self._level_since
+            return {
+                "enabled": self.enabled,
+                "active_tier": self.tiers[self._level].to_dict(),
+                "level": self._level,
+                "in_flight": self._in_flight,
+                "latency_ewma_ms": round(self._latency_ewma_ms, 2) if self._latency_ewma_ms is not None else None,
+                "queue_depth_thresholds": self.queue_depth_thresholds,
+                "latency_thresholds_ms": self.latency_thresholds_ms,
+                "transitions": self._transitions,
+                "requests_per_tier": dict(self._requests_per_tier),
+                "seconds_per_tier": {name: round(value, 1) for name, value in seconds.items()},
+            }
@@ -0,0 +1,475 @@
+"""
+Shared Prediction Result Cache
+A result cache every local worker process can share, keyed by image content
+hash plus model version, so a repeated upload is never run through the model
+twice - whichever uvicorn worker or replica it lands on.
+
+Backends:
+- MmapCacheBackend: fixed-size, set-associative table in a memory-mapped file.
+  All processes on the node map the same file; a file lock serializes access.
+  Size-bounded by construction (LRU within each set), entries expire after a TTL.
+- RespCacheBackend: any Redis-protocol server (redis-server, KeyDB, Dragonfly
+  or a local stand-in). Entries use SET ... EX for TTL; a sorted-set index
+  bounds the number of entries.
+
+A cache failure never fails a prediction: errors are counted and treated as misses.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+class CacheUnavailableError(ConnectionError):
+    """Backend is known to be down and is not retried until its cooldown ends"""
+
+
+def cache_key(image_hash: str, model_version: str) -> str:
+    return f"{model_version}:{image_hash}"
+
+
+class CacheBackend:
+    """Interface + shared hit/miss accounting for cache backends."""
+
+    name = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "errors": 0, "unavailable": 0,
+                       "skipped_too_large": 0, "get_time_ms": 0.0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            value = self._get(key)
+        except CacheUnavailableError:
+            self._count("unavailable")
+            value = None
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"⚠️ {self.name} cache get failed: {e}")
+            value = None
+        with self._stats_lock:
+            self._stats["hits" if value is not None else "misses"] += 1
+            self._stats["get_time_ms"] += (time.perf_counter() - start) * 1000
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        try:
+            if self._set(key, json.dumps(value, separators=(",", ":")).encode("utf-8")):
+                self._count("sets")
+        except CacheUnavailableError:
+            self._count("unavailable")
+        except Exception as e:
+            self._count("errors")
+            logger.warning(f"⚠️ {self.name} cache set failed: {e}")
+
+    def _count(self, field: str) -> None:
+        with self._stats_lock:
+            self._stats[field] += 1
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def _set(self, key: str, payload: bytes) -> bool:
+        raise NotImplementedError
+
+    def shared_stats(self) -> Dict[str, Any]:
+        """Counters aggregated across all worker processes, if the backend keeps them"""
+        return {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["avg_get_ms"] = round(stats.pop("get_time_ms") / lookups, 4) if lookups else None
+        try:
+            shared = self.shared_stats()
+        except Exception as e:
+            shared = {"error": str(e)}
+        return {"backend": self.name, "this_worker": stats, "all_workers": shared}
+
+
+# ============================================================================
+# MEMORY-MAPPED FILE BACKEND
+# ============================================================================
+class MmapCacheBackend(CacheBackend):
+    """
+    File layout:
+      header (64 bytes): magic, version, num_sets, ways, slot_size, hits, misses
+      slots: num_sets * ways fixed-size slots, each
+        key digest (16) | stored_at (f64) | last_used (f64) | expires_at (f64) | length (u32) | payload
+    """
+
+    name = "mmap"
+    MAGIC = b"FIQC"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIIIIQQ")
+    HEADER_SIZE = 64
+    HITS_OFFSET = 20     # shared counters inside HEADER, updated under the file lock
+    MISSES_OFFSET = 28
+    SLOT_HEADER = struct.Struct("<16sdddI")
+
+    def __init__(self, path: Path, max_entries: int = 8192, slot_size: int = 2048,
+                 ways: int = 4, ttl_seconds: float = 24 * 3600):
+        super().__init__()
+        self.ways = ways
+        self.num_sets = max(1, max_entries // ways)
+        self.slot_size = slot_size
+        # The layout is part of the file name: workers configured differently (e.g. mid
+        # rolling config change) get separate files instead of resizing a mapped one
+        path = Path(path)
+        self.path = path.with_name(
+            f"{path.stem}.{self.num_sets}x{self.ways}x{self.slot_size}.v{self.VERSION}{path.suffix}"
+        )
+        self.ttl_seconds = ttl_seconds
+        self.max_payload = slot_size - self.SLOT_HEADER.size
+        self._thread_lock = threading.Lock()  # flock is per-process; this covers threads
+        self._open()
+        if hasattr(os, "register_at_fork"):
+            # flock is tied to the open file description - forked workers need their own
+            os.register_at_fork(after_in_child=self._reopen)
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = self.HEADER_SIZE + self.num_sets * self.ways * self.slot_size
+        # r+b on an O_CREAT descriptor: positional writes (append mode would ignore seek)
+        self._file = os.fdopen(os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o644), "r+b")
+        with self._locked():
+            self._file.seek(0, os.SEEK_END)
+            existing = self._file.tell()
+            header = None
+            if existing >= self.HEADER_SIZE:
+                self._file.seek(0)
+                header = self.HEADER.unpack(self._file.read(self.HEADER.size))
+            layout = (self.MAGIC, self.VERSION, self.num_sets, self.ways, self.slot_size)
+            mismatch = existing != 0 and (existing != size or header is None or header[:5] != layout)
+            if existing == 0:
+                # Nobody can have an empty file mapped - safe to initialize
+                self._file.truncate(size)
+                self._file.seek(0)
+                self._file.write(self.HEADER.pack(*layout, 0, 0))
+                self._file.flush()
+                logger.info(f"Initialized shared result cache {self.path} ({size / (1024 * 1024):.1f} MB)")
+        if mismatch:
+            # Never truncate a file other workers may have mapped (SIGBUS for them)
+            self._file.close()
+            raise RuntimeError(
+                f"{self.path} does not match this worker's cache layout ({existing} bytes, "
+                f"expected {size}); delete it while all workers are stopped"
+            )
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+    def _reopen(self) -> None:
+        self._thread_lock = threading.Lock()
+        self._mm.close()
+        self._file.close()
+        self._open()
+
+    def _locked(self):
+        backend = self
+
+        class _Lock:
+            def __enter__(self):
+                backend._thread_lock.acquire()
+                if fcntl is not None:
+                    fcntl.flock(backend._file.fileno(), fcntl.LOCK_EX)
+                else:
+                    backend._file.seek(0)
+                    msvcrt.locking(backend._file.fileno(), msvcrt.LK_LOCK, 1)
+
+            def __exit__(self, *exc):
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(backend._file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        backend._file.seek(0)
+                        msvcrt.locking(backend._file.fileno(), msvcrt.LK_UNLCK, 1)
+                finally:
+                    backend._thread_lock.release()
+
+        return _Lock()
+
+    def _slot_offsets(self, digest: bytes) -> List[int]:
+        set_index = int.from_bytes(digest[:8], "little") % self.num_sets
+        base = self.HEADER_SIZE + set_index * self.ways * self.slot_size
+        return [base + way * self.slot_size for way in range(self.ways)]
+
+    def _bump_counter(self, offset: int) -> None:
+        (value,) = struct.unpack_from("<Q", self._mm, offset)
+        struct.pack_into("<Q", self._mm, offset, value + 1)
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        digest = hashlib.sha256(key.encode("utf-8")).digest()[:16]
+        now = time.time()
+        with self._locked():
+            for offset in self._slot_offsets(digest):
+                slot_digest, stored_at, _, expires_at, length = self.SLOT_HEADER.unpack_from(self._mm, offset)
+                if slot_digest == digest and length and expires_at > now:
+                    struct.pack_into("<d", self._mm, offset + 24, now)  # last_used
+                    payload = bytes(self._mm[offset + self.SLOT_HEADER.size:offset + self.SLOT_HEADER.size + length])
+                    self._bump_counter(self.HITS_OFFSET)
+                    return json.loads(payload)
+            self._bump_counter(self.MISSES_OFFSET)
+        return None
+
+    def _set(self, key: str, payload: bytes) -> bool:
+        if len(payload) > self.max_payload:
+            self._count("skipped_too_large")
+            return False
+        digest = hashlib.sha256(key.encode("utf-8")).digest()[:16]
+        now = time.time()
+        with self._locked():
+            target, oldest_used = None, None
+            for offset in self._slot_offsets(digest):
+                slot_digest, _, last_used, expires_at, length = self.SLOT_HEADER.unpack_from(self._mm, offset)
+                if slot_digest == digest or not length or expires_at <= now:
+                    target = offset
+                    break
+                if oldest_used is None or last_used < oldest_used:
+                    target, oldest_used = offset, last_used  # LRU victim within the set
+            self.SLOT_HEADER.pack_into(self._mm, target, digest, now, now, now + self.ttl_seconds, len(payload))
+            start = target + self.SLOT_HEADER.size
+            self._mm[start:start + len(payload)] = payload
+        return True
+
+    def shared_stats(self) -> Dict[str, Any]:
+        with self._locked():
+            header = self.HEADER.unpack_from(self._mm, 0)
+            now = time.time()
+            live = 0
+            for i in range(self.num_sets * self.ways):
+                offset = self.HEADER_SIZE + i * self.slot_size
+                _, _, _, expires_at, length = self.SLOT_HEADER.unpack_from(self._mm, offset)
+                if length and expires_at > now:
+                    live += 1
+        hits, misses = header[5], header[6]
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "entries": live,
+            "capacity": self.num_sets * self.ways,
+            "path": str(self.path),
+        }
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+
+# ============================================================================
+# REDIS-PROTOCOL (RESP) BACKEND
+# ============================================================================
+class RespError(Exception):
+    """Error reply from a RESP server"""
+
+
+class RespCacheBackend(CacheBackend):
+    """
+    Minimal RESP2 client - no redis package needed, works against any
+    Redis-compatible server including lightweight local stand-ins.
+
+    A lookup is one round trip: the GET is pipelined with the hit/miss
+    counter increments accumulated since the previous call, so the shared
+    counters lag by at most one lookup per worker. After a connection
+    failure the server is not retried until a cooldown passes (doubling up
+    to max_retry_interval); meanwhile get/set return immediately as misses.
+    """
+
+    name = "redis"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, password: Optional[str] = None,
+                 db: int = 0, prefix: str = "farmiq:pred:", max_entries: int = 100000,
+                 ttl_seconds: float = 24 * 3600, timeout: float = 0.5,
+                 retry_interval: float = 1.0, max_retry_interval: float = 30.0):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.ttl_seconds = int(ttl_seconds)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._index_supported = True
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._cooldown = retry_interval
+        self._down_until = 0.0
+        self._pending_counts = {"__hits__": 0, "__misses__": 0}
+
+    # --- protocol ---------------------------------------------------------
+    def _connect(self) -> None:
+        now = time.monotonic()
+        if now < self._down_until:
+            raise CacheUnavailableError(f"{self.host}:{self.port} unavailable, retrying in "
+                                        f"{self._down_until - now:.1f}s")
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def _mark_down(self, error: Exception) -> None:
+        """Start (or extend) the reconnect cooldown after a connection-level failure"""
+        self._down_until = time.monotonic() + self._cooldown
+        logger.warning(f"⚠️ RESP cache {self.host}:{self.port} unavailable ({error}) - "
+                       f"treating lookups as misses for {self._cooldown:.0f}s")
+        self._cooldown = min(self._cooldown * 2, self.max_retry_interval)
+
+    def _close(self) -> None:
+        try:
+            if self._reader:
+                self._reader.close()
+            if self._sock:
+                self._sock.close()
+        finally:
+            self._sock, self._reader = None, None
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("RESP server closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RespError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise RespError(f"Unexpected RESP reply: {line!r}")
+
+    def _call(self, *args):
+        return self._pipeline([args])[0]
+
+    def _pipeline(self, commands: List[tuple]) -> List[Any]:
+        """Send several commands in one round trip; error replies are returned, not raised"""
+        try:
+            if self._sock is None:
+                self._connect()
+            self._sock.sendall(b"".join(self._encode(*cmd) for cmd in commands))
+            replies = []
+            for _ in commands:
+                try:
+                    replies.append(self._read_reply())
+                except RespError as e:
+                    replies.append(e)
+            self._cooldown = self.retry_interval
+            return replies
+        except CacheUnavailableError:
+            raise
+        except (OSError, ConnectionError) as e:
+            self._close()
+            self._mark_down(e)
+            raise CacheUnavailableError(str(e)) from e
+
+    # --- cache operations -------------------------------------------------
+    def _counter_commands(self) -> List[tuple]:
+        """INCRBY commands for counts accumulated since the last round trip (lock held)"""
+        commands = [("INCRBY", self.prefix + name, n) for name, n in self._pending_counts.items() if n]
+        for name in self._pending_counts:
+            self._pending_counts[name] = 0
+        return commands
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._pipeline([("GET", self.prefix + key)] + self._counter_commands())[0]
+            if isinstance(value, RespError):
+                raise value
+            self._pending_counts["__hits__" if value is not None else "__misses__"] += 1
+        return json.loads(value) if value is not None else None
+
+    def _set(self, key: str, payload: bytes) -> bool:
+        full_key = self.prefix + key
+        index_key = self.prefix + "__index__"
+        with self._lock:
+            commands = [("SET", full_key, payload, "EX", self.ttl_seconds)]
+            if self._index_supported:
+                commands += [("ZADD", index_key, time.time(), full_key), ("ZCARD", index_key)]
+            replies = self._pipeline(commands)
+            if isinstance(replies[0], RespError):
+                raise replies[0]
+            if self._index_supported and any(isinstance(r, RespError) for r in replies[1:]):
+                # Stand-in without sorted sets: rely on TTL alone for bounding
+                self._index_supported = False
+                logger.warning("⚠️ RESP server lacks ZADD/ZCARD - cache size bounded by TTL only")
+            elif self._index_supported and replies[2] > self.max_entries:
+                overflow = replies[2] - self.max_entries
+                popped = self._call("ZPOPMIN", index_key, overflow)
+                victims = popped[0::2] if isinstance(popped, list) else []
+                if victims:
+                    self._call("DEL", *victims)
+        return True
+
+    def shared_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses, entries = self._pipeline(self._counter_commands() + [
+                ("GET", self.prefix + "__hits__"),
+                ("GET", self.prefix + "__misses__"),
+                ("ZCARD", self.prefix + "__index__"),
+            ])[-3:]
+        hits = int(hits) if isinstance(hits, bytes) else 0
+        misses = int(misses) if isinstance(misses, bytes) else 0
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "entries": entries if isinstance(entries, int) else None,
+            "capacity": self.max_entries,
+            "server": f"{self.host}:{self.port}/{self.db}",
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+def create_cache_backend(kind: str, **options) -> Optional[CacheBackend]:
+    """Build a backend from configuration: 'mmap', 'redis' or 'none'"""
+    kind = (kind or "none").lower()
+    if kind == "none":
+        return None
+    if kind == "mmap":
+        return MmapCacheBackend(**options)
+    if kind in ("redis", "resp"):
+        return RespCacheBackend(**options)
+    raise ValueError(f"Unknown result cache backend: {kind}")
@@ -0,0 +1,230 @@
+"""
+Tiled Inference for Large Field / Drone Images
+Cuts a large image into overlapping model-sized tiles, skips empty tiles,
+runs the remaining tiles through the model in a few large batches and
+aggregates the results into a coverage summary and a compact heatmap.
+
+The model is passed in as a `predict_fn(batch) -> probabilities` callable so
+this module stays independent of TensorFlow.
+"""
+import base64
+import io
+import logging
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 160
+BACKGROUND_CLASS = "Background_without_leaves"
+
+# Empty-tile heuristics (computed on a 4x subsampled tile, 0-255 scale)
+EMPTY_STD_THRESHOLD = 8.0       # almost flat tile: sky, bare wall, lens cap
+EMPTY_DARK_THRESHOLD = 20.0     # mean brightness below this: shadow / night
+EMPTY_BRIGHT_THRESHOLD = 240.0  # mean brightness above this: blown-out
+
+
+def is_healthy_class(class_name: str) -> bool:
+    return class_name.endswith("healthy")
+
+
+def tile_positions(length: int, tile: int, stride: int) -> List[int]:
+    """Start offsets along one axis; the last tile is aligned to the edge."""
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile + 1, stride))
+    if positions[-1] != length - tile:
+        positions.append(length - tile)
+    return positions
+
+
+def load_image_for_tiling(image_bytes: bytes, max_side: int, tile: int = TILE_SIZE) -> np.ndarray:
+    """
+    Decode to an RGB uint8 array, downscaling so the longest side is at most
+    `max_side` and upscaling so the shortest side is at least one tile.
+    Raises ValueError for aspect ratios beyond max_side / tile, which cannot
+    satisfy both limits.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    width, height = img.size
+    if max(width, height) > min(width, height) * max_side / tile:
+        raise ValueError(
+            f"Aspect ratio of {width}x{height} exceeds {max_side / tile:.1f}:1 "
+            f"(longest side {max_side}, shortest side at least {tile})"
+        )
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    scale = 1.0
+    if max(width, height) > max_side:
+        scale = max_side / max(width, height)
+    if min(width, height) * scale < tile:
+        scale = tile / min(width, height)
+    if scale != 1.0:
+        new_size = (
+            min(max_side, max(tile, round(width * scale))),
+            min(max_side, max(tile, round(height * scale))),
+        )
+        img = img.resize(new_size, Image.Resampling.BILINEAR)
+        logger.info(f"   Rescaled {width}x{height} -> {new_size[0]}x{new_size[1]} for tiling")
+
+    return np.asarray(img, dtype=np.uint8)
+
+
+def find_empty_tiles(img_array: np.ndarray, xs: Sequence[int], ys: Sequence[int], tile: int) -> np.ndarray:
+    """
+    Boolean mask (row-major over the grid) of tiles that are obviously empty
+    (flat, black or blown-out). Works one grid row at a time on 4x subsampled
+    tile views, so only a row's worth of small samples is ever copied.
+    """
+    empty = np.empty(len(ys) * len(xs), dtype=bool)
+    for row, y in enumerate(ys):
+        band = img_array[y:y + tile:4]
+        sample = np.stack([band[:, x:x + tile:4] for x in xs]).astype(np.float32)
+        flat = sample.reshape(len(xs), -1)
+        std = flat.std(axis=1)
+        mean = flat.mean(axis=1)
+        empty[row * len(xs):(row + 1) * len(xs)] = (
+            (std < EMPTY_STD_THRESHOLD) | (mean < EMPTY_DARK_THRESHOLD) | (mean > EMPTY_BRIGHT_THRESHOLD)
+        )
+    return empty
+
+
+def encode_heatmap(grid: np.ndarray) -> str:
+    """Grayscale PNG (one pixel per tile, 0-255 = disease score), base64-encoded."""
+    buffer = io.BytesIO()
+    Image.fromarray(grid, mode="L").save(buffer, format="PNG", optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def run_tiled_inference(
+    img_array: np.ndarray,
+    predict_fn: Callable[[np.ndarray], np.ndarray],
+    class_names: Sequence[str],
+    overlap: float = 0.25,
+    batch_size: int = 128,
+    max_tiles: int = 4096,
+    include_tiles: bool = True,
+    tile: int = TILE_SIZE,
+) -> Dict[str, Any]:
+    """
+    Run tiled inference over an RGB uint8 image.
+
+    predict_fn receives a float32 batch of shape (N, tile, tile, 3) holding raw
+    0-255 pixel values and must return class probabilities of shape (N, C). The
+    batch buffer is reused between calls, so predict_fn may modify it in place.
+    """
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("overlap must be in [0, 1)")
+
+    height, width = img_array.shape[:2]
+    stride = max(1, int(round(tile * (1.0 - overlap))))
+    xs = tile_positions(width, tile, stride)
+    ys = tile_positions(height, tile, stride)
+    num_tiles = len(xs) * len(ys)
+    if num_tiles > max_tiles:
+        raise ValueError(
+            f"Image would produce {num_tiles} tiles (limit {max_tiles}); "
+            f"reduce max_side or overlap"
+        )
+
+    start = time.time()
+
+    # Tile positions, row-major over the grid; pixels stay in img_array until batched
+    positions: List[Tuple[int, int]] = [(x, y) for y in ys for x in xs]
+    empty_mask = find_empty_tiles(img_array, xs, ys, tile)
+    keep_indices = np.flatnonzero(~empty_mask)
+    tiling_time = time.time() - start
+
+    # Cut only the non-empty tiles, one batch at a time, into a single reused
+    # float32 buffer - memory is bounded by batch_size, not by the tile count
+    inference_start = time.time()
+    probabilities = np.zeros((num_tiles, len(class_names)), dtype=np.float32)
+    batch = np.empty((min(batch_size, max(1, len(keep_indices))), tile, tile, 3), dtype=np.float32)
+    num_batches = 0
+    for batch_start in range(0, len(keep_indices), batch_size):
+        batch_indices = keep_indices[batch_start:batch_start + batch_size]
+        for row, index in enumerate(batch_indices):
+            x, y = positions[index]
+            batch[row] = img_array[y:y + tile, x:x + tile]
+        probabilities[batch_indices] = predict_fn(batch[:len(batch_indices)])[:, :len(class_names)]
+        num_batches += 1
+    inference_time = time.time() - inference_start
+
+    # Aggregate
+    healthy_idx = [i for i, name in enumerate(class_names) if is_healthy_class(name)]
+    background_idx = [i for i, name in enumerate(class_names) if name == BACKGROUND_CLASS]
+    disease_score = 1.0 - probabilities[:, healthy_idx + background_idx].sum(axis=1)
+    disease_score = np.clip(disease_score, 0.0, 1.0)
+    disease_score[empty_mask] = 0.0
+
+    top_idx = probabilities.argmax(axis=1)
+    class_counts: Dict[str, int] = {}
+    leaf_tiles = 0
+    diseased_tiles = 0
+    tile_results = []
+    for i in keep_indices:
+        class_name = class_names[top_idx[i]]
+        class_counts[class_name] = class_counts.get(class_name, 0) + 1
+        if class_name != BACKGROUND_CLASS:
+            leaf_tiles += 1
+            if not is_healthy_class(class_name):
+                diseased_tiles += 1
+        if include_tiles:
+            x, y = positions[i]
+            tile_results.append({
+                "x": x,
+                "y": y,
+                "class": class_name,
+                "confidence": float(probabilities[i, top_idx[i]]),
+                "disease_score": round(float(disease_score[i]), 4),
+            })
+
+    disease_counts = {
+        name: count for name, count in class_counts.items()
+        if name != BACKGROUND_CLASS and not is_healthy_class(name)
+    }
+    dominant_disease = max(disease_counts, key=disease_counts.get) if disease_counts else None
+
+    heatmap = np.round(disease_score.reshape(len(ys), len(xs)) * 255).astype(np.uint8)
+    total_time = time.time() - start
+
+    analyzed = int(len(keep_indices))
+    return {
+        "image_size": {"width": width, "height": height},
+        "tiling": {
+            "tile_size": tile,
+            "stride": stride,
+            "overlap": overlap,
+            "grid": {"rows": len(ys), "cols": len(xs)},
+            "total_tiles": num_tiles,
+            "analyzed_tiles": analyzed,
+            "skipped_empty_tiles": num_tiles - analyzed,
+        },
+        "summary": {
+            "leaf_tiles": leaf_tiles,
+            "diseased_tiles": diseased_tiles,
+            "disease_coverage": round(diseased_tiles / leaf_tiles, 4) if leaf_tiles else 0.0,
+            "mean_disease_score": round(float(disease_score[keep_indices].mean()), 4) if analyzed else 0.0,
+            "dominant_disease": dominant_disease,
+            "class_counts": dict(sorted(class_counts.items(), key=lambda kv: -kv[1])),
+        },
+        "heatmap": {
+            "rows": len(ys),
+            "cols": len(xs),
+            "encoding": "png_base64",
+            "description": "one pixel per tile, 0-255 = disease score",
+            "data": encode_heatmap(heatmap),
+        },
+        "tiles": tile_results if include_tiles else None,
+        "performance": {
+            "tiling_time_ms": round(tiling_time * 1000, 2),
+            "inference_time_ms": round(inference_time * 1000, 2),
+            "total_time_ms": round(total_time * 1000, 2),
+            "model_calls": num_batches,
+            "tiles_per_second": round(analyzed / inference_time, 2) if inference_time > 0 else None,
+        },
+    }